@@ -8,3 +8,5 @@ from .receipt_parser import RuleBased  # type: ignore
 from .finder import Finder  # type: ignore
 from .normalizer import Normalizer  # type: ignore
 from .cat_model import PredictCategory  # type: ignore
+from .known import KnownDescriptions  # type: ignore
+from .pipeline import Pipeline  # type: ignore
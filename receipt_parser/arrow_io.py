@@ -0,0 +1,144 @@
+"""Parse Apache Arrow tables and Parquet files."""
+from typing import Optional, Union
+import pandas as pd  # type: ignore
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except ImportError:
+    pa = pc = pq = None
+
+# Functions of `pyarrow.compute` are generated at runtime:
+# pylint: disable=no-member
+
+RESULT_COLUMNS = ["product_norm", "brand_norm", "cat_norm"]
+
+
+def require_pyarrow() -> None:
+    """Raise an error if pyarrow is not installed."""
+
+    if pa is None:
+        raise ImportError(
+            "Для работы с Arrow и Parquet установите pyarrow: `pip install pyarrow`."
+        )
+
+
+def is_arrow(data) -> bool:
+    """Check if data is an Arrow table or array."""
+
+    return pa is not None and isinstance(data, (pa.Table, pa.Array, pa.ChunkedArray))
+
+
+def parse_arrow(
+    rules,
+    data: Union["pa.Table", "pa.Array", "pa.ChunkedArray"],
+    column: str = "name",
+    verbose: int = 0,
+) -> "pa.Table":
+    """
+    Parse descriptions stored in Arrow. Each distinct description
+    is converted to a Python object and parsed only once, results are
+    spread back by indices without leaving Arrow.
+
+    Parameters
+    ----------
+    rules : RuleBased
+        Loaded parser.
+    data : Union[pa.Table, pa.Array, pa.ChunkedArray]
+        Arrow table with the `column` or an array of descriptions.
+    column : str, (default="name")
+        Column with descriptions.
+    verbose: int (default=0)
+        Set verbose to any positive number for verbosity.
+
+    Returns
+    -------
+    pa.Table
+        Descriptions and dictionary-encoded `product_norm`,
+        `brand_norm` and `cat_norm` columns.
+    """
+
+    require_pyarrow()
+    if isinstance(data, pa.Table):
+        if column not in data.column_names:
+            raise ValueError(
+                f"Столбец с описанием товара должен иметь название `{column}`."
+            )
+        data = data.column(column)
+
+    unique = pc.unique(pc.drop_null(data))
+    if isinstance(unique, pa.ChunkedArray):
+        unique = unique.combine_chunks()
+    indices = pc.index_in(data, value_set=unique)
+    if len(unique):
+        names = pd.Series(unique.to_pylist(), name="name", dtype=object)
+        parsed = rules.parse(names, verbose)
+    else:
+        parsed = pd.DataFrame(columns=RESULT_COLUMNS)
+
+    columns = {"name": data}
+    for col in RESULT_COLUMNS:
+        values = pa.array(parsed[col], type=pa.string(), from_pandas=True)
+        encoded = pc.dictionary_encode(values)
+        codes = pc.take(encoded.indices, indices)
+        if isinstance(codes, pa.ChunkedArray):
+            codes = codes.combine_chunks()
+        columns[col] = pa.DictionaryArray.from_arrays(codes, encoded.dictionary)
+    return pa.table(columns)
+
+
+def parse_parquet(
+    rules,
+    source: str,
+    destination: str,
+    column: str = "name",
+    batch_size: Optional[int] = None,
+) -> int:
+    """
+    Parse a Parquet file chunk by chunk and write results as Parquet
+    with dictionary-encoded product, brand and category columns.
+
+    Parameters
+    ----------
+    rules : RuleBased
+        Loaded parser.
+    source : str
+        Path to the Parquet file with descriptions.
+    destination : str
+        Path to the result Parquet file.
+    column : str, (default="name")
+        Column with descriptions, other columns are not read.
+    batch_size : Optional[int], (default=None)
+        Number of rows in a chunk. By default the file
+        is read by its row groups.
+
+    Returns
+    -------
+    int
+        Number of parsed rows.
+    """
+
+    require_pyarrow()
+    parquet = pq.ParquetFile(source)
+    if batch_size is None:
+        chunks = (
+            parquet.read_row_group(i, columns=[column])
+            for i in range(parquet.num_row_groups)
+        )
+    else:
+        chunks = parquet.iter_batches(batch_size=batch_size, columns=[column])
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            result = parse_arrow(rules, chunk.column(column))
+            if writer is None:
+                writer = pq.ParquetWriter(destination, result.schema)
+            writer.write_table(result)
+            rows += result.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
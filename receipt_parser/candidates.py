@@ -0,0 +1,97 @@
+"""Tokens of a product description and phrases to look up in datasets."""
+from typing import List, Optional, Set, Tuple
+from itertools import combinations
+
+POLICIES: Tuple[str, ...] = ("pairs", "adjacent")
+
+
+class Candidates:
+    """
+    Split a product description into words once and build the phrases
+    which `Finder` looks up in `brands_ru.csv` and `products.csv`.
+    The phrases are rebuilt only when a search stage changes the words
+    of the description: brand removal, `-` splitting or lemmatization.
+
+    Parameters
+    ----------
+    name : str
+        Normalized product description.
+    policy : str, (default="pairs")
+        Which two-word phrases to build:
+        * `pairs` - all pairs of words in their original order,
+        * `adjacent` - only neighbouring words, linear in the number of words.
+
+    Attributes
+    ----------
+    tokens : Tuple[str, ...]
+        Words of the product description.
+
+    Examples
+    --------
+    >>> cands = Candidates('вода питьевая негаз', policy='adjacent')
+    >>> cands.phrases
+    {'вода', 'питьевая', 'негаз', 'вода питьевая', 'питьевая негаз'}
+    """
+
+    def __init__(self, name: Optional[str], policy: str = "pairs"):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Неизвестная политика `{policy}`, допустимые значения: {POLICIES}."
+            )
+        self.policy = policy
+        self.tokens: Tuple[str, ...] = tuple(name.split()) if name else ()
+        self._phrases: Optional[Set[str]] = None
+
+    def update(self, name: Optional[str]) -> None:
+        """
+        Synchronize tokens with the new product description.
+        Built phrases are kept if the words have not changed and
+        filtered instead of rebuilt if some words were only removed.
+        """
+
+        tokens = tuple(name.split()) if name else ()
+        if tokens == self.tokens:
+            return
+
+        removed = set(self.tokens) - set(tokens)
+        if (
+            self._phrases is not None
+            and self.policy == "pairs"
+            and removed
+            and len(tokens) + sum(word in removed for word in self.tokens)
+            == len(self.tokens)
+            and self.__is_subsequence(tokens, self.tokens)
+        ):
+            self._phrases = {
+                phrase
+                for phrase in self._phrases
+                if not removed.intersection(phrase.split())
+            }
+        else:
+            self._phrases = None
+        self.tokens = tokens
+
+    @staticmethod
+    def __is_subsequence(short: Tuple[str, ...], long: Tuple[str, ...]) -> bool:
+        """Check if `short` can be obtained by removing words from `long`."""
+
+        words = iter(long)
+        return all(token in words for token in short)
+
+    def __build(self) -> Set[str]:
+        """Build one-word and two-word phrases according to the policy."""
+
+        tokens: List[str] = list(self.tokens)
+        if self.policy == "adjacent":
+            pairs = zip(tokens, tokens[1:])
+        else:
+            pairs = combinations(tokens, 2)  # type: ignore
+        return set([f"{first} {second}" for first, second in pairs] + tokens)
+
+    @property
+    def phrases(self) -> Set[str]:
+        """One-word and two-word phrases to look up in the datasets."""
+
+        if self._phrases is None:
+            self._phrases = self.__build()
+        return self._phrases
@@ -1,9 +1,29 @@
-"""Predict a category using a neural network."""
+"""
+Predict a category using a neural network.
+
+The weights can be exported to a compact file with int8 or float16
+embedding and fc weights, which is memory-mapped instead of loaded:
+workers of one machine share its pages and loading takes no time.
+
+Examples
+--------
+$ python -m receipt_parser.cat_model models/cat_model.pth cat_model.int8
+>>> PredictCategory("cat_bpe_model.yttm", "cat_model.int8", model_params)
+"""
 # pylint: skip-file
-from typing import Dict, List
+import sys
+import json
+import struct
+import argparse
+import threading
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np  # type: ignore
 import youtokentome as yttm  # type: ignore
 import torch
 from torch import nn
+from torch.nn import functional as F
 
 
 class CategoryClassifier(nn.Module):
@@ -53,12 +73,245 @@ class CategoryClassifier(nn.Module):
         return y_out
 
 
+MAGIC = b"RPQM"
+ALIGNMENT = 64
+
+
+def _quantize(weight: np.ndarray, dtype: str) -> Dict[str, np.ndarray]:
+    """
+    Quantize rows of the weight: int8 with a scale of each row
+    (symmetric, the largest absolute value is 127) or float16.
+    """
+
+    if dtype == "float16":
+        return {"": weight.astype(np.float16)}
+    if dtype != "int8":
+        raise ValueError(f"Неизвестный тип весов: `{dtype}`, нужен int8 или float16.")
+    scale = np.abs(weight).max(axis=1) / 127
+    scale[scale == 0] = 1
+    quantized = np.round(weight / scale[:, None]).astype(np.int8)
+    return {"": quantized, "_scale": scale.astype(np.float32)}
+
+
+def export_quantized(model: CategoryClassifier, path: str, dtype: str = "int8") -> None:
+    """
+    Save the weights of the model to a file for `QuantizedClassifier`.
+
+    The file is `MAGIC`, the length of a JSON header and the header with
+    offsets, shapes and types of the arrays, then the raw arrays aligned
+    to `ALIGNMENT` bytes.
+
+    Parameters
+    ----------
+    model : CategoryClassifier
+        Trained model.
+    path : str
+        Path to the file.
+    dtype : str, (default="int8")
+        Type of the embedding and fc weights: `int8` or `float16`.
+    """
+
+    state = {name: value.numpy() for name, value in model.state_dict().items()}
+    arrays = {"fc.bias": state["fc.bias"].astype(np.float32)}
+    for name in ("embedding.weight", "fc.weight"):
+        arrays.update(
+            (name + suffix, value)
+            for suffix, value in _quantize(state[name], dtype).items()
+        )
+
+    header: Dict[str, Any] = {"dtype": dtype, "mode": model.embedding.mode}
+    header["arrays"], offset = {}, 0
+    for name, value in arrays.items():
+        header["arrays"][name] = {
+            "offset": offset,
+            "shape": list(value.shape),
+            "dtype": value.dtype.str,
+        }
+        offset += -(-value.nbytes // ALIGNMENT) * ALIGNMENT
+    data = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 4 + len(data)) // ALIGNMENT) * ALIGNMENT
+    with open(path, "wb") as file:
+        file.write(MAGIC + struct.pack("<I", len(data)) + data)
+        for name, value in arrays.items():
+            file.seek(start + header["arrays"][name]["offset"])
+            file.write(np.ascontiguousarray(value).tobytes())
+        file.truncate(start + offset)
+
+
+def is_quantized(path: str) -> bool:
+    """Check that the file was saved by `export_quantized`."""
+
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class QuantizedClassifier:
+    """
+    `CategoryClassifier` with memory-mapped quantized weights.
+    Only rows of the embedding of the tokens of a batch are dequantized,
+    the whole embedding is never copied to the memory of a process.
+
+    Parameters
+    ----------
+    path : str
+        File saved by `export_quantized`.
+    """
+
+    def __init__(self, path: str):
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+        size = struct.unpack("<I", mapped[len(MAGIC) : len(MAGIC) + 4].tobytes())[0]
+        header = json.loads(mapped[len(MAGIC) + 4 : len(MAGIC) + 4 + size].tobytes())
+        start = -(-(len(MAGIC) + 4 + size) // ALIGNMENT) * ALIGNMENT
+        self.dtype: str = header["dtype"]
+        if header["mode"] != "mean":
+            raise ValueError(f"Режим `{header['mode']}` не поддерживается.")
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            offset = start + info["offset"]
+            count = int(np.prod(info["shape"]))
+            self.arrays[name] = (
+                mapped[offset : offset + count * dtype.itemsize]
+                .view(dtype)
+                .reshape(info["shape"])
+            )
+
+    def __weight(self, name: str, rows: Optional[np.ndarray] = None) -> torch.Tensor:
+        """Dequantized weight or its rows."""
+
+        weight = self.arrays[name]
+        weight = weight if rows is None else weight[rows]
+        if self.dtype == "float16":
+            return torch.from_numpy(weight.astype(np.float32))
+        scale = self.arrays[name + "_scale"]
+        scale = scale if rows is None else scale[rows]
+        return torch.from_numpy(weight.astype(np.float32) * scale[:, None])
+
+    def forward(self, x_in: torch.Tensor, offsets: torch.Tensor) -> torch.Tensor:
+        """
+        The forward pass of the classifier.
+
+        Parameters
+        ----------
+        x_in : torch.Tensor
+            Flat tokens of all texts.
+        offsets : torch.Tensor
+            Start of each text in `x_in`.
+
+        Returns
+        -------
+        torch.Tensor [batch_size x num_class]
+        """
+
+        tokens, inverse = np.unique(x_in.numpy(), return_inverse=True)
+        embedded = F.embedding_bag(
+            torch.from_numpy(inverse.reshape(-1)),
+            self.__weight("embedding.weight", tokens),
+            offsets,
+            mode="mean",
+        )
+        bias = torch.from_numpy(self.arrays["fc.bias"].copy())
+        return F.linear(embedded, self.__weight("fc.weight"), bias)
+
+    def __call__(self, x_in: torch.Tensor, offsets: torch.Tensor) -> torch.Tensor:
+        return self.forward(x_in, offsets)
+
+    def share_memory(self) -> "QuantizedClassifier":
+        """Memory-mapped weights are already shared between processes."""
+
+        return self
+
+
+class LogitsCache:
+    """
+    Bounded thread-safe cache of logits of descriptions, the least
+    recently used ones are evicted. Logits are kept in one preallocated
+    float32 matrix, not in objects of each description, and they give
+    categories and scores at any temperature.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of descriptions.
+    width : int
+        Number of categories.
+    """
+
+    def __init__(self, size: int, width: int):
+        self.size = size
+        self.rows = np.empty((size, width), dtype=np.float32)
+        self.slots: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def get(self, names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find cached descriptions.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Mask of found descriptions and their logits.
+        """
+
+        found = np.zeros(len(names), dtype=bool)
+        slots = []
+        with self._lock:
+            for i, name in enumerate(names):
+                slot = self.slots.get(name)
+                if slot is not None:
+                    self.slots.move_to_end(name)
+                    found[i] = True
+                    slots.append(slot)
+            return found, self.rows[slots]
+
+    def put(self, names: Sequence[str], logits: np.ndarray) -> None:
+        """Cache logits of distinct descriptions."""
+
+        with self._lock:
+            for name, row in zip(names[-self.size :], logits[-self.size :]):
+                if name in self.slots:
+                    self.slots.move_to_end(name)
+                    slot = self.slots[name]
+                elif len(self.slots) < self.size:
+                    slot = len(self.slots)
+                else:
+                    slot = self.slots.popitem(last=False)[1]
+                self.slots[name] = slot
+                self.rows[slot] = row
+
+
 class PredictCategory:
-    """Predict a category using a neural network."""
+    """
+    Predict a category using a neural network.
+    `path_to_model` is a state dict of `CategoryClassifier` or a file
+    saved by `export_quantized`.
+
+    Batches are encoded by one multi-threaded call of the BPE model
+    and packed into a flat buffer of tokens with offsets of descriptions,
+    the input of `nn.EmbeddingBag`. The buffers grow to the largest batch
+    and are reused, each thread has its own.
+
+    Scores of `predict_top_k` are the softmax of logits divided by
+    `temperature`, fit it on labelled descriptions with `calibrate`
+    so that scores match the share of right predictions.
 
+    Logits of up to `cache_size` recent descriptions are cached,
+    see `LogitsCache`, `warm` fills the cache in advance.
+    """
+
+    # pylint: disable=bad-continuation
     def __init__(
-        self, path_to_bpe: str, path_to_model: str, model_params: Dict[str, int]
+        self,
+        path_to_bpe: str,
+        path_to_model: str,
+        model_params: Dict[str, int],
+        temperature: float = 1.0,
+        cache_size: int = 65536,
     ):
+        self.temperature = temperature
         self.bpe_model = yttm.BPE(path_to_bpe)
         self.categories: List[str] = [
             "Алкоголь",
@@ -84,14 +337,231 @@ class PredictCategory:
             "Чай, кофе, сахар",
         ]
         self.device = torch.device("cpu")
-        self.model = CategoryClassifier(**model_params)
-        self.model.load_state_dict(torch.load(path_to_model, map_location=self.device))
-        self.model.eval()
+        self.model: Any
+        if is_quantized(path_to_model):
+            self.model = QuantizedClassifier(path_to_model)
+        else:
+            self.model = CategoryClassifier(**model_params)
+            self.model.load_state_dict(
+                torch.load(path_to_model, map_location=self.device)
+            )
+            self.model.eval()
+        self._buffers = threading.local()
+        self.cache = (
+            LogitsCache(cache_size, len(self.categories)) if cache_size > 0 else None
+        )
+
+    def __buffer(self, name: str, size: int) -> np.ndarray:
+        """Reusable int64 buffer of at least `size` elements of this thread."""
+
+        buffer = getattr(self._buffers, name, np.empty(0, dtype=np.int64))
+        if len(buffer) < size:
+            # Grow twice at least, a few larger batches don't reallocate each time:
+            buffer = np.empty(max(size, 2 * len(buffer)), dtype=np.int64)
+            setattr(self._buffers, name, buffer)
+        return buffer
+
+    def encode_batch(self, names: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Encode descriptions with BPE and pack them for `nn.EmbeddingBag`.
+
+        Parameters
+        ----------
+        names : List[str]
+            Normalized descriptions.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor]
+            Flat tokens of all descriptions and offsets of each description.
+            The tensors are views of the buffers of the thread and are
+            overwritten by its next batch.
+        """
+
+        ids = self.bpe_model.encode(names, output_type=yttm.OutputType.ID)
+        lengths = np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+        offsets = self.__buffer("offsets", len(ids))[: len(ids)]
+        if len(ids):
+            offsets[0] = 0
+            np.cumsum(lengths[:-1], out=offsets[1:])
+        total = int(lengths.sum())
+        tokens = self.__buffer("tokens", total)[:total]
+        tokens[:] = np.fromiter(chain.from_iterable(ids), dtype=np.int64, count=total)
+        return torch.from_numpy(tokens), torch.from_numpy(offsets)
+
+    def __forward(self, names: List[str]) -> torch.Tensor:
+        """Logits of the model for a batch of descriptions."""
+
+        tokens, offsets = self.encode_batch(names)
+        with torch.no_grad():
+            return self.model(tokens.to(self.device), offsets.to(self.device))
+
+    def __logits(self, names: List[str], batch_size: int) -> Iterator[torch.Tensor]:
+        """
+        Logits for each batch of descriptions. Only descriptions
+        missing in the cache are passed to the model, once each.
+        """
+
+        for start in range(0, len(names), batch_size):
+            batch = names[start : start + batch_size]
+            if self.cache is None:
+                yield self.__forward(batch)
+                continue
+            found, cached = self.cache.get(batch)
+            logits = np.empty((len(batch), len(self.categories)), dtype=np.float32)
+            logits[found] = cached
+            if not found.all():
+                index: Dict[str, int] = {}
+                inverse = [
+                    index.setdefault(name, len(index))
+                    for name, hit in zip(batch, found)
+                    if not hit
+                ]
+                output = self.__forward(list(index)).numpy()
+                logits[~found] = output[inverse]
+                self.cache.put(list(index), output)
+            yield torch.from_numpy(logits)
+
+    def warm(self, names: Iterable[str], batch_size: int = 4096) -> int:
+        """
+        Predict distinct descriptions in batches and cache them.
+        Return the number of cached descriptions.
+        """
+
+        if self.cache is None:
+            return 0
+        unique = list(dict.fromkeys(names))[-self.cache.size :]
+        for start in range(0, len(unique), batch_size):
+            batch = unique[start : start + batch_size]
+            self.cache.put(batch, self.__forward(batch).numpy())
+        return len(self.cache)
+
+    def predict_batch(self, names: List[str], batch_size: int = 4096) -> List[str]:
+        """
+        Predict categories of many descriptions.
+
+        Parameters
+        ----------
+        names : List[str]
+            Normalized descriptions.
+        batch_size : int, (default=4096)
+            Number of descriptions in a forward pass.
+
+        Returns
+        -------
+        List[str]
+            Category of each description.
+        """
+
+        result: List[str] = []
+        for output in self.__logits(names, batch_size):
+            result.extend(self.categories[i] for i in output.argmax(1).tolist())
+        return result
+
+    def predict_top_k(
+        self, names: List[str], k: int = 3, batch_size: int = 4096
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict `k` most probable categories of each description.
+
+        Parameters
+        ----------
+        names : List[str]
+            Normalized descriptions.
+        k : int, (default=3)
+            Number of categories of a description.
+        batch_size : int, (default=4096)
+            Number of descriptions in a forward pass.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Indexes of categories in `categories` (int16) and their
+            calibrated scores (float32), both `len(names) x k`,
+            the most probable category first.
+
+        Examples
+        --------
+        >>> labels, scores = model.predict_top_k(["молоко"], k=2)
+        >>> [model.categories[i] for i in labels[0]], scores[0]
+        (['Молоко, сыр, яйца', 'Товары для мам и детей'], array([0.91, 0.05]))
+        """
+
+        k = min(k, len(self.categories))
+        labels = np.empty((len(names), k), dtype=np.int16)
+        scores = np.empty((len(names), k), dtype=np.float32)
+        start = 0
+        for output in self.__logits(names, batch_size):
+            probs = torch.softmax(output / self.temperature, dim=1)
+            values, indexes = probs.topk(k, dim=1)
+            labels[start : start + len(output)] = indexes.numpy()
+            scores[start : start + len(output)] = values.numpy()
+            start += len(output)
+        return labels, scores
+
+    def calibrate(
+        self,
+        names: List[str],
+        categories: Sequence[str],
+        temperatures: Optional[Sequence[float]] = None,
+    ) -> float:
+        """
+        Fit `temperature` to labelled descriptions: choose the one
+        with the least negative log-likelihood of the right categories.
+
+        Parameters
+        ----------
+        names : List[str]
+            Normalized descriptions.
+        categories : Sequence[str]
+            Right category of each description, descriptions
+            of unknown categories are skipped.
+        temperatures : Optional[Sequence[float]], (default=None)
+            Temperatures to try, 100 from 0.05 to 20 by default.
+
+        Returns
+        -------
+        float
+            The chosen temperature, it is also set to `temperature`.
+        """
+
+        index = {category: i for i, category in enumerate(self.categories)}
+        rows = [i for i, category in enumerate(categories) if category in index]
+        if not rows:
+            raise ValueError("Нет описаний с известными категориями.")
+        target = torch.tensor([index[categories[i]] for i in rows])
+        logits = torch.cat(list(self.__logits([names[i] for i in rows], 4096)))
+        if temperatures is None:
+            temperatures = np.geomspace(0.05, 20, 100).tolist()
+        losses = [
+            F.cross_entropy(logits / temperature, target).item()
+            for temperature in temperatures
+        ]
+        self.temperature = float(temperatures[int(np.argmin(losses))])
+        return self.temperature
 
     def predict(self, name_norm: str) -> str:
         """Predict category by name norm."""
 
-        text = self.bpe_model.encode(name_norm)
-        text = torch.tensor(text).to(self.device)
-        output = self.model(text, torch.tensor([0]).to(self.device))
-        return self.categories[output.argmax(1).item()]
+        return self.predict_batch([name_norm])[0]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line interface: export a model to a quantized file."""
+
+    parser = argparse.ArgumentParser(description="Export quantized weights.")
+    parser.add_argument("path_to_model", help="state dict of CategoryClassifier")
+    parser.add_argument("path_to_save", help="where to save the quantized model")
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    parser.add_argument("--vocab-size", type=int, default=500)
+    parser.add_argument("--embed-dim", type=int, default=50)
+    parser.add_argument("--num-class", type=int, default=21)
+    args = parser.parse_args(argv)
+
+    model = CategoryClassifier(args.vocab_size, args.embed_dim, args.num_class)
+    model.load_state_dict(torch.load(args.path_to_model, map_location="cpu"))
+    export_quantized(model, args.path_to_save, args.dtype)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,280 @@
+"""
+Decide how to apply a function to the rows of a batch: serially,
+in threads or in processes. The decision is based on the cost of
+a row measured on a sample of the first batch and the overhead
+of pools measured once per host.
+"""
+import os
+import json
+import math
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+import pandas as pd  # type: ignore
+from pandarallel import pandarallel  # type: ignore
+
+try:
+    from receipt_parser.resources import default_cache_dir  # type: ignore
+except ImportError:
+    from resources import default_cache_dir  # type: ignore
+
+MODES = ("serial", "threads", "processes")
+
+Plan = NamedTuple("Plan", [("mode", str), ("workers", int), ("chunk_size", int)])
+
+# pandarallel keeps the number of workers in global settings:
+_PANDARALLEL_LOCK = threading.Lock()
+
+
+def _noop(value: Any) -> Any:
+    """Cheapest possible function to measure overhead of pools."""
+
+    return value
+
+
+def run_plan(
+    data: Union[pd.Series, pd.DataFrame], func: Callable, plan: Plan, **kwargs
+) -> Union[pd.Series, pd.DataFrame]:
+    """
+    Apply `func` to `data` as planned. Processes are started by pandarallel,
+    which gives each of them one chunk, so no more than `plan.workers`
+    processes get chunks of at least `plan.chunk_size` rows.
+    Threads get chunks of `plan.chunk_size` rows.
+    """
+
+    if plan.mode == "processes":
+        workers = min(plan.workers, math.ceil(len(data) / max(plan.chunk_size, 1)))
+        with _PANDARALLEL_LOCK:
+            pandarallel.initialize(
+                nb_workers=max(workers, 1), progress_bar=False, verbose=0
+            )
+            return data.parallel_apply(func, **kwargs)
+    if plan.mode == "threads" and len(data) > plan.chunk_size:
+        chunks = [
+            data.iloc[start : start + plan.chunk_size]
+            for start in range(0, len(data), plan.chunk_size)
+        ]
+        with ThreadPoolExecutor(max_workers=plan.workers) as executor:
+            return pd.concat(
+                list(executor.map(lambda chunk: chunk.apply(func, **kwargs), chunks))
+            )
+    return data.apply(func, **kwargs)
+
+
+class CostModel:
+    """
+    Self-calibrating cost model of `Apply.series_apply` and `Apply.df_apply`.
+
+    The first time a function is applied to a batch larger than
+    `sample_size`, its first rows are applied serially and timed.
+    The same sample is also run in threads to see if the function
+    releases the GIL. If the batch is expensive enough to consider
+    a pool, the overhead of starting processes and threads and of
+    sending a row to a process is measured on dummy data once per host.
+    Each batch then runs the cheapest of:
+    - serial: `rows * cost`;
+    - threads: `thread_overhead + rows * cost / thread_speedup`;
+    - processes: `pool_overhead + rows * (transfer + cost / cpus)`.
+    Measurements are saved to a JSON file in the cache directory
+    under the name of the host.
+
+    Parameters
+    ----------
+    path : Optional[str], (default=None)
+        JSON file with measurements, `cost_model.json`
+        in `resources.default_cache_dir()` by default.
+    cpus : Optional[int], (default=None)
+        Number of CPUs, `os.cpu_count()` by default.
+    sample_size : int, (default=500)
+        Number of rows to measure the cost of a function.
+    min_parallel_time : float, (default=0.05)
+        Batches which take less seconds serially always run serially
+        without measuring the overhead of pools.
+    """
+
+    # pylint: disable=bad-continuation
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        cpus: Optional[int] = None,
+        sample_size: int = 500,
+        min_parallel_time: float = 0.05,
+    ):
+        self.path = path or os.path.join(default_cache_dir(), "cost_model.json")
+        self.cpus = cpus or os.cpu_count() or 1
+        self.sample_size = sample_size
+        self.min_parallel_time = min_parallel_time
+        self.host = f"{socket.gethostname()}:{self.cpus}"
+        self._lock = threading.RLock()
+        self.stats: Dict[str, Any] = {"functions": {}}
+        self.load()
+
+    def load(self) -> None:
+        """Load measurements of this host from the cache file."""
+
+        try:
+            with open(self.path, "r", encoding="UTF-8") as file:
+                stats = json.load(file).get(self.host)
+        except (OSError, ValueError):
+            return
+        if isinstance(stats, dict) and isinstance(stats.get("functions"), dict):
+            self.stats = stats
+
+    def save(self) -> None:
+        """
+        Save measurements of this host to the cache file.
+        A read-only cache directory is not an error.
+        """
+
+        try:
+            with open(self.path, "r", encoding="UTF-8") as file:
+                hosts = json.load(file)
+        except (OSError, ValueError):
+            hosts = {}
+        hosts[self.host] = self.stats
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="UTF-8") as file:
+                json.dump(hosts, file, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def calibrate_host(self) -> Dict[str, float]:
+        """Measure overhead of pools of threads and processes."""
+
+        workers = min(self.cpus, 4)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_noop, range(workers)))
+        thread_overhead = time.perf_counter() - start
+
+        pool_overhead = transfer = math.inf
+        if self.cpus > 1:
+            start = time.perf_counter()
+            run_plan(
+                pd.Series(range(self.cpus)), _noop, Plan("processes", self.cpus, 1)
+            )
+            pool_overhead = time.perf_counter() - start
+
+            rows = 20000
+            plan = Plan("processes", self.cpus, math.ceil(rows / self.cpus))
+            start = time.perf_counter()
+            run_plan(pd.Series(["x" * 50] * rows), _noop, plan)
+            transfer = max(time.perf_counter() - start - pool_overhead, 0.0) / rows
+
+        host = {
+            "thread_overhead": thread_overhead,
+            "pool_overhead": pool_overhead,
+            "transfer": transfer,
+        }
+        with self._lock:
+            self.stats.update(host)
+            self.save()
+        return host
+
+    def calibrate(
+        self, key: str, sample: Union[pd.Series, pd.DataFrame], func: Callable, **kwargs
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """
+        Measure the cost of a row of `func` and the speedup of threads
+        on the sample. Return the result of applying `func` to the sample.
+        """
+
+        start = time.perf_counter()
+        result = sample.apply(func, **kwargs)
+        cost = (time.perf_counter() - start) / len(sample)
+
+        workers = min(self.cpus, 4)
+        speedup = 1.0
+        if workers > 1:
+            plan = Plan("threads", workers, math.ceil(len(sample) / workers))
+            start = time.perf_counter()
+            run_plan(sample, func, plan, **kwargs)
+            threaded = (time.perf_counter() - start) / len(sample)
+            # Noise of short measurements can't make threads faster than that:
+            speedup = min(cost / threaded, workers) if threaded else workers
+
+        with self._lock:
+            self.stats["functions"][key] = {
+                "cost": cost,
+                "thread_speedup": speedup,
+                "thread_workers": workers,
+            }
+            self.save()
+        return result
+
+    def plan(self, key: str, rows: int) -> Plan:
+        """Choose the cheapest way to apply a calibrated function to `rows` rows."""
+
+        function = self.stats["functions"][key]
+        serial = rows * function["cost"]
+        if serial < self.min_parallel_time:
+            return Plan("serial", 1, rows)
+        if "pool_overhead" not in self.stats:
+            self.calibrate_host()
+
+        workers = function["thread_workers"]
+        estimates = {
+            "serial": serial,
+            "threads": self.stats["thread_overhead"]
+            + serial / max(function["thread_speedup"], 1e-9),
+            "processes": self.stats["pool_overhead"]
+            + rows * (self.stats["transfer"] + function["cost"] / self.cpus),
+        }
+        mode = min(MODES, key=lambda name: estimates[name])
+        if mode == "threads":
+            return Plan(mode, workers, max(math.ceil(rows / (workers * 4)), 1))
+        if mode == "processes":
+            return Plan(mode, self.cpus, math.ceil(rows / self.cpus))
+        return Plan(mode, 1, rows)
+
+    def apply(
+        self, data: Union[pd.Series, pd.DataFrame], func: Callable, key: str, **kwargs
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """
+        Apply `func` to `data` in the cheapest way. An uncalibrated
+        function is first measured on the head of `data`.
+
+        Parameters
+        ----------
+        data : Union[pd.Series, pd.DataFrame]
+            The data on which the `func` function will be applied.
+        func : function
+            Function to apply to each row.
+        key : str
+            Name of the function in the measurements.
+        **kwargs
+            Other parameters of `apply`.
+        """
+
+        with self._lock:
+            is_known = key in self.stats["functions"]
+        if is_known:
+            return run_plan(data, func, self.plan(key, len(data)), **kwargs)
+        if len(data) <= self.sample_size:
+            return data.apply(func, **kwargs)
+
+        head = self.calibrate(key, data.iloc[: self.sample_size], func, **kwargs)
+        rest = data.iloc[self.sample_size :]
+        return pd.concat(
+            [head, run_plan(rest, func, self.plan(key, len(rest)), **kwargs)]
+        )
+
+
+_DEFAULT: Optional[CostModel] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_cost_model() -> CostModel:
+    """Return the cost model shared by all `Apply` calls of the process."""
+
+    global _DEFAULT  # pylint: disable=global-statement
+
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = CostModel()
+        return _DEFAULT
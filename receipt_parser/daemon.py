@@ -0,0 +1,322 @@
+"""
+Long-lived parsing daemon for non-Python callers. Requests and responses
+are newline-delimited JSON sent over a Unix domain socket or stdin/stdout.
+
+Request: `{"id": 1, "names": ["Майонез MR.RICCO Провансаль 67% д/п 400"]}`
+or `{"id": 2, "name": "..."}` for a single description.
+Response: `{"id": 1, "results": [{"name": ..., "product_norm": ...,
+"brand_norm": ..., "cat_norm": ...}]}` or `{"id": 2, "result": {...}}`.
+A request which can't be parsed gets `{"id": ..., "error": "..."}`.
+A line longer than `LINE_LIMIT` gets `{"id": null, "error": "..."}`
+and the connection is closed after responses to the previous requests.
+`{"id": 3, "command": "version"}` returns the version of the lexicons
+to invalidate cached results: `{"id": 3, "version": "..."}`.
+
+Examples
+--------
+$ python -m receipt_parser.daemon --socket /run/receipt_parser.sock
+$ python -m receipt_parser.daemon --stdio < requests.jsonl
+$ kill -HUP <pid>  # reload lexicons without dropping connections
+"""
+import os
+import sys
+import json
+import stat
+import signal
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import pandas as pd  # type: ignore
+
+try:
+    from receipt_parser.receipt_parser import RuleBased  # type: ignore
+except ImportError:
+    from receipt_parser import RuleBased  # type: ignore
+
+LINE_LIMIT = 64 * 1024 * 1024
+LINE_TOO_LONG = {
+    "id": None,
+    "error": f"ValueError: Строка запроса длиннее {LINE_LIMIT} байт.",
+}
+
+
+def _records(data: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert parsed descriptions to JSON objects with `null` for NaN."""
+
+    data = data.astype(object).where(data.notna(), None)
+    return data.to_dict("records")
+
+
+class Daemon:
+    """
+    Keep a loaded `RuleBased` and parse requests of many clients with it.
+    Each line is parsed in a thread pool as soon as it is read, so
+    a client can send requests without waiting for responses (pipelining).
+
+    Parameters
+    ----------
+    pathes: Optional[Dict[str, str]] (default=None)
+        Dictionary with paths to *.csv files.
+    workers: int, (default=4)
+        Number of threads parsing requests.
+    max_in_flight: int, (default=64)
+        Maximum number of requests of a connection in progress.
+        Reading of the connection stops until responses are sent.
+    ordered: bool, (default=True)
+        Send responses in the order of requests. Otherwise send them
+        as soon as they are ready, the client matches them by `id`.
+    **kwargs
+        Other parameters of `RuleBased`.
+    """
+
+    # pylint: disable=bad-continuation
+    def __init__(
+        self,
+        pathes: Optional[Dict[str, str]] = None,
+        workers: int = 4,
+        max_in_flight: int = 64,
+        ordered: bool = True,
+        **kwargs,
+    ):
+        self.pathes = pathes
+        self.kwargs = kwargs
+        self.max_in_flight = max_in_flight
+        self.ordered = ordered
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.rules = self.__load()
+        self._reloading = False
+
+    def __load(self) -> RuleBased:
+        """Load a parser, multiprocessing doesn't pay off for single requests."""
+
+        rules = RuleBased(self.pathes, **self.kwargs)
+        rules.norm.use_parallel = False
+        return rules
+
+    @staticmethod
+    def handle(rules: RuleBased, line: bytes) -> Dict[str, Any]:
+        """Parse a request line and return the response."""
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Запрос должен быть JSON-объектом.")
+            request_id = request.get("id")
+            if request.get("command") == "version":
+                return {"id": request_id, "version": rules.version}
+            if "names" in request:
+                names = request["names"]
+                if not isinstance(names, list) or any(
+                    not isinstance(name, str) for name in names
+                ):
+                    raise ValueError("Поле `names` должно быть списком строк.")
+                names = pd.Series(names, name="name", dtype=object)
+                return {"id": request_id, "results": _records(rules.parse(names))}
+            if "name" in request:
+                if not isinstance(request["name"], str):
+                    raise ValueError("Поле `name` должно быть строкой.")
+                names = pd.Series([request["name"]], name="name", dtype=object)
+                return {"id": request_id, "result": _records(rules.parse(names))[0]}
+            raise ValueError("Запрос должен содержать поле `names` или `name`.")
+        except Exception as error:  # pylint: disable=broad-except
+            return {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+
+    def __submit(self, line: bytes) -> "asyncio.Future[Dict[str, Any]]":
+        """Parse the line in the thread pool with the current parser."""
+
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, self.handle, self.rules, line)
+
+    @staticmethod
+    async def __write(writer: asyncio.StreamWriter, response: Dict[str, Any]) -> None:
+        """Send a response line, a closed connection only stops sending."""
+
+        try:
+            writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            writer.close()
+
+    async def __serve_ordered(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Read requests while earlier ones are parsed, respond in order."""
+
+        in_flight: asyncio.Queue = asyncio.Queue(maxsize=self.max_in_flight)
+
+        async def respond() -> None:
+            while True:
+                future = await in_flight.get()
+                if future is None:
+                    return
+                response = await future
+                if not writer.is_closing():
+                    await self.__write(writer, response)
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            try:
+                async for line in reader:
+                    if line.strip():
+                        await in_flight.put(self.__submit(line))
+            except ValueError:
+                # The line is longer than `LINE_LIMIT`, the stream can't be
+                # split into requests any more:
+                too_long = asyncio.get_running_loop().create_future()
+                too_long.set_result(LINE_TOO_LONG)
+                await in_flight.put(too_long)
+            await in_flight.put(None)
+            await responder
+        finally:
+            responder.cancel()
+
+    async def __serve_unordered(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Read requests while earlier ones are parsed, respond when ready."""
+
+        slots = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(future) -> None:
+            try:
+                response = await future
+                async with write_lock:
+                    if not writer.is_closing():
+                        await self.__write(writer, response)
+            finally:
+                slots.release()
+
+        too_long = False
+        try:
+            async for line in reader:
+                if line.strip():
+                    await slots.acquire()
+                    task = asyncio.ensure_future(respond(self.__submit(line)))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except ValueError:
+            # The line is longer than `LINE_LIMIT`, see `__serve_ordered`:
+            too_long = True
+        if tasks:
+            await asyncio.gather(*tasks)
+        if too_long:
+            async with write_lock:
+                if not writer.is_closing():
+                    await self.__write(writer, LINE_TOO_LONG)
+
+    async def serve_stream(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve a single connection until the client closes it."""
+
+        try:
+            if self.ordered:
+                await self.__serve_ordered(reader, writer)
+            else:
+                await self.__serve_unordered(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def reload(self) -> None:
+        """
+        Load lexicons again in the background, see `RuleBased.reload`.
+        Requests in progress finish with the old lexicons.
+        """
+
+        if self._reloading:
+            return
+        self._reloading = True
+        try:
+            loop = asyncio.get_running_loop()
+            version = await loop.run_in_executor(None, self.rules.reload)
+            print(f"Lexicons version: {version}", file=sys.stderr)
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"Reload failed, keep the old lexicons: {error}", file=sys.stderr)
+        finally:
+            self._reloading = False
+
+    def __handle_signals(self, stop: asyncio.Event) -> None:
+        """Reload on SIGHUP and stop on SIGTERM and SIGINT."""
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.ensure_future(self.reload())
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+
+    async def serve_unix(self, path: str) -> None:
+        """Listen on a Unix domain socket until SIGTERM or SIGINT."""
+
+        stop = asyncio.Event()
+        self.__handle_signals(stop)
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)  # Left by a killed daemon
+        server = await asyncio.start_unix_server(
+            self.serve_stream, path=path, limit=LINE_LIMIT
+        )
+        async with server:
+            await stop.wait()
+
+    async def serve_stdio(self) -> None:
+        """Read requests from stdin and write responses to stdout until EOF."""
+
+        stop = asyncio.Event()
+        self.__handle_signals(stop)
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=LINE_LIMIT)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout
+        )
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        serving = asyncio.ensure_future(self.serve_stream(reader, writer))
+        stopping = asyncio.ensure_future(stop.wait())
+        await asyncio.wait([serving, stopping], return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line interface."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--socket", help="path to the Unix domain socket")
+    source.add_argument("--stdio", action="store_true", help="use stdin and stdout")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="send responses as soon as they are ready",
+    )
+    parser.add_argument(
+        "--category-cache-size",
+        type=int,
+        default=65536,
+        help="number of cached predictions of the model, 0 disables the cache",
+    )
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        ordered=not args.unordered,
+        category_cache_size=args.category_cache_size,
+    )
+    if args.stdio:
+        asyncio.run(daemon.serve_stdio())
+    else:
+        asyncio.run(daemon.serve_unix(args.socket))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
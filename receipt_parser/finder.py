@@ -2,23 +2,33 @@
 Search and recognize the name, category and
 brand of a product from its description.
 """
-from typing import Optional, List, Union, Dict
-from itertools import combinations
+import threading
+from itertools import chain
+from typing import Optional, List, Union, Dict, Tuple
 import pandas as pd  # type: ignore
 from pymystem3 import Mystem  # type: ignore
 
 try:
     from cat_model import PredictCategory  # type: ignore
+    from candidates import Candidates  # type: ignore
+    from resources import Resources  # type: ignore
+    from fuzzy import DeletionIndex  # type: ignore
 except ImportError:
     from receipt_parser.cat_model import PredictCategory  # type: ignore
+    from receipt_parser.candidates import Candidates  # type: ignore
+    from receipt_parser.resources import Resources  # type: ignore
+    from receipt_parser.fuzzy import DeletionIndex  # type: ignore
 
 # pylint: disable=C1801
 
+# Category of descriptions which the model can't predict confidently:
+UNCERTAIN = "uncertain"
+
 
 def df_apply(data: pd.DataFrame, func, axis: int = 1) -> pd.DataFrame:
     """
         User define the `apply` function from pd.DataFrame.
-        Use only for 2-column and 3-column data.
+        Columns are passed to `func` as positional arguments.
 
         Parameters
         ----------
@@ -37,18 +47,11 @@ def df_apply(data: pd.DataFrame, func, axis: int = 1) -> pd.DataFrame:
 
         Examples
         --------
-        >>> from pandas import DataFrame
-
-        >>> DataFrame.my_apply = df_apply
-        >>> df[['name', 'brand']].my_apply(foo)
+        >>> df_apply(df[['name', 'brand']], foo)
         """
 
     _cols = data.columns
-    _len = len(_cols)
-
-    if _len == 2:
-        return data.apply(lambda x: func(x[_cols[0]], x[_cols[1]]), axis=axis)
-    return data.apply(lambda x: func(x[_cols[0]], x[_cols[1]], x[_cols[2]]), axis=axis)
+    return data.apply(lambda x: func(*(x[col] for col in _cols)), axis=axis)
 
 
 class Finder:
@@ -61,7 +64,30 @@ class Finder:
     Parameters
     ----------
     pathes: Optional[Dict[str, str]], (default=None)
-        Dictionary with paths to required files.
+        Dictionary with paths to required files. Missing files are
+        searched in the package data and in the cache,
+        see `receipt_parser.resources.Resources`.
+    candidates_policy: str, (default="pairs")
+        Which word combinations to look up in the datasets:
+        all pairs of words or only adjacent ones.
+        See `receipt_parser.candidates.Candidates`.
+    fuzzy_distance: int, (default=0)
+        Maximum edit distance to words of `products.csv` and `brands_ru.csv`
+        for words not found exactly, see `receipt_parser.fuzzy`.
+        Fuzzy search runs before Mystem, 0 disables it.
+    fuzzy_confidence: float, (default=0.75)
+        Minimum confidence of a fuzzy match.
+    min_confidence: Optional[float], (default=None)
+        Minimum calibrated score of a category predicted by the model,
+        `UNCERTAIN` is assigned instead of less confident predictions.
+        By default the most probable category is always assigned.
+    temperature: float, (default=1.0)
+        Temperature of scores of the model,
+        see `PredictCategory.calibrate`.
+    category_cache_size: int, (default=65536)
+        Number of descriptions whose predictions of the model are cached,
+        0 disables the cache. It is filled with all products of
+        `products.csv` and `all_clean.csv` at load time.
 
     Attributes
     ----------
@@ -69,6 +95,8 @@ class Finder:
         A Python wrapper of the Yandex Mystem 3.1 morphological
         analyzer (http://api.yandex.ru/mystem).
         See aslo `https://github.com/nlpub/pymystem3`.
+    mystem_lock : threading.Lock
+        Lock for the Mystem process shared by all threads.
     cat_model: PredictCategory
         Class for predicting a category by product description
         using a neural network written in PyTorch.
@@ -77,11 +105,14 @@ class Finder:
     products : pd.DataFrame
         DataFrame of product names and categories.
     all_clean : pd.DataFrame
-        General dataset with all product information.
-    data: pd.DataFrame
-        Text column with a description of the products to parse.
-        Products description should be normalized by Normalizer.
-        See `receipt_parser.normalize.Normalizer`.
+        General dataset with products, brands and categories
+        stored as categorical columns.
+    brand_goods : Dict[str, Tuple[str, str]]
+        The most common product and category for each brand in `all_clean`.
+    fuzzy_products : Optional[DeletionIndex]
+        Deletion index of products if fuzzy search is enabled.
+    fuzzy_brands : Optional[DeletionIndex]
+        Deletion index of Russian brands if fuzzy search is enabled.
 
     Examples
     --------
@@ -96,27 +127,95 @@ class Finder:
     See also `receipt_parser.parsers.tinkoff`.
     """
 
-    def __init__(self, pathes: Optional[Dict[str, str]] = None):
-        pathes = pathes or {}
+    # pylint: disable=bad-continuation,too-many-arguments
+    def __init__(
+        self,
+        pathes: Optional[Dict[str, str]] = None,
+        candidates_policy: str = "pairs",
+        fuzzy_distance: int = 0,
+        fuzzy_confidence: float = 0.75,
+        min_confidence: Optional[float] = None,
+        temperature: float = 1.0,
+        category_cache_size: int = 65536,
+    ):
+        pathes = Resources().resolve(
+            pathes,
+            names=["cat_bpe_model", "cat_model", "brands_ru", "products", "all_clean"],
+        )
+        self.candidates_policy = candidates_policy
         self.mystem = Mystem()
-        pd.DataFrame.appl = df_apply
+        # Mystem is a single subprocess, the lock keeps requests from mixing up:
+        self.mystem_lock = threading.Lock()
 
         # Init model:
         model_params = {"num_class": 21, "embed_dim": 50, "vocab_size": 500}
-        bpe_model = pathes.get("cat_bpe_model", "models/cat_bpe_model.yttm")
-        cat_model = pathes.get("cat_model", "models/cat_model.pth")
-        self.cat_model = PredictCategory(bpe_model, cat_model, model_params)
+        bpe_model = pathes["cat_bpe_model"]
+        cat_model = pathes["cat_model"]
+        self.cat_model = PredictCategory(
+            bpe_model, cat_model, model_params, temperature, category_cache_size
+        )
+        self.min_confidence = min_confidence
 
         # Read DataFrames:
-        brands = pathes.get("brands_ru", "data/cleaned/brands_ru.csv")
-        products = pathes.get("products", "data/cleaned/products.csv")
-        all_clean = pathes.get("all_clean", "data/cleaned/all_clean.csv")
-        self.brands_ru = pd.read_csv(brands)["brand"].values
-        self.products = pd.read_csv(products)
-        self.all_clean = pd.read_csv(all_clean)
-        self.data = pd.DataFrame()
-
-    def find_brands(self, name: str, brand: Optional[str] = None) -> pd.Series:
+        brands = pathes["brands_ru"]
+        products = pathes["products"]
+        all_clean = pathes["all_clean"]
+        self.brands_ru = pd.read_csv(brands, usecols=["brand"])["brand"].values
+        self.products = pd.read_csv(
+            products, usecols=["product", "category"], dtype={"category": "category"}
+        )
+        self.all_clean = pd.read_csv(
+            all_clean, usecols=["Продукт", "Бренд", "Категория"], dtype="category"
+        )
+        self.brand_goods = self.__most_common_goods(self.all_clean)
+        self.cat_model.warm(
+            chain(
+                self.products["product"].dropna(),
+                self.all_clean["Продукт"].cat.categories,
+            )
+        )
+
+        # Init fuzzy search:
+        self.fuzzy_confidence = fuzzy_confidence
+        self.fuzzy_products: Optional[DeletionIndex] = None
+        self.fuzzy_brands: Optional[DeletionIndex] = None
+        if fuzzy_distance > 0:
+            self.fuzzy_products = DeletionIndex(
+                self.products["product"], fuzzy_distance
+            )
+            self.fuzzy_brands = DeletionIndex(self.brands_ru, fuzzy_distance)
+
+    @staticmethod
+    def __most_common_goods(all_clean: pd.DataFrame) -> Dict[str, Tuple[str, str]]:
+        """
+        Find the most common product and category for each brand.
+        Ties are resolved in favor of the first occurrence in the dataset.
+        """
+
+        most_common: Dict[str, Dict[str, str]] = {}
+        for column in ["Продукт", "Категория"]:
+            counts = (
+                all_clean.groupby(["Бренд", column], observed=True, sort=False)
+                .size()
+                .reset_index(name="count")
+                .sort_values("count", ascending=False, kind="mergesort")
+                .drop_duplicates("Бренд")
+            )
+            most_common[column] = dict(zip(counts["Бренд"], counts[column]))
+
+        products, categories = most_common["Продукт"], most_common["Категория"]
+        return {
+            brand: (product, categories[brand])
+            for brand, product in products.items()
+            if brand in categories
+        }
+
+    def find_brands(
+        self,
+        name: str,
+        brand: Optional[str] = None,
+        candidates: Optional[Candidates] = None,
+    ) -> pd.Series:
         """
         Find Russian brands using the dataset `brands_ru.csv`.
         For more accurate recognition, a combination of words in a
@@ -128,6 +227,9 @@ class Finder:
             Product name.
         brand : str, optional (default=None)
             Product category.
+        candidates : Candidates, optional (default=None)
+            Word combinations of the product name shared between
+            search stages. Built from `name` if not passed.
 
         Returns
         -------
@@ -136,16 +238,25 @@ class Finder:
         """
 
         if name and not brand:
-            names = set(
-                [f"{comb[0]} {comb[1]}" for comb in combinations(name.split(), 2)]
-                + name.split()
-            )
+            candidates = self.__sync_candidates(name, candidates)
+            names = candidates.phrases
             for rus_brand in self.brands_ru:
                 if rus_brand in names:
                     name = name.replace(rus_brand, "").replace("  ", " ").strip()
+                    candidates.update(name)
                     return pd.Series([name, rus_brand])
         return pd.Series([name, brand])
 
+    def __sync_candidates(
+        self, name: str, candidates: Optional[Candidates]
+    ) -> Candidates:
+        """Create word combinations or update them to the current name."""
+
+        if candidates is None:
+            return Candidates(name, self.candidates_policy)
+        candidates.update(name)
+        return candidates
+
     @staticmethod
     def __remove_duplicate_word(arr: List[str]) -> List[str]:
         """
@@ -177,7 +288,11 @@ class Finder:
 
     # pylint: disable=bad-continuation
     def find_product(
-        self, name: str, product: str, category: Optional[str] = None
+        self,
+        name: str,
+        product: str,
+        category: Optional[str] = None,
+        candidates: Optional[Candidates] = None,
     ) -> pd.Series:
         """
         Find products name using the dataset `products.csv`.
@@ -192,6 +307,9 @@ class Finder:
             Product description.
         category : str, optional (default=None)
             Product category.
+        candidates : Candidates, optional (default=None)
+            Word combinations of the product name shared between
+            search stages. Built from `name` if not passed.
 
         Returns
         -------
@@ -200,13 +318,8 @@ class Finder:
         """
 
         if name and not product:
-            names = pd.DataFrame(
-                set(
-                    [f"{comb[0]} {comb[1]}" for comb in combinations(name.split(), 2)]
-                    + name.split()
-                ),
-                columns=["product"],
-            )
+            candidates = self.__sync_candidates(name, candidates)
+            names = pd.DataFrame(list(candidates.phrases), columns=["product"])
             merge = self.products.merge(names)
             if len(merge):
                 product = ", ".join(
@@ -215,9 +328,53 @@ class Finder:
                 if len(merge) == 1:
                     category = merge["category"].values[0]
                 else:
-                    category = self.cat_model.predict(name)
+                    category = self.predict_categories([name])[0]
         return pd.Series([name, product, category])
 
+    def __fuzzy_lookup(
+        self, index: DeletionIndex, name: str
+    ) -> Optional[Tuple[str, str]]:
+        """Find the first word of the name with a confident match in the index."""
+
+        for word in name.split():
+            match = index.lookup(word)
+            if match is not None and match.confidence >= self.fuzzy_confidence:
+                return word, match.term
+        return None
+
+    def find_fuzzy(self, name: str, product: str, brand: str) -> pd.Series:
+        """
+        Find products and Russian brands by words with typos
+        using deletion indexes of `products.csv` and `brands_ru.csv`.
+        Categories of found products are assigned by `find_category`.
+
+        Parameters
+        ----------
+        name : str
+            Product name.
+        product : str
+            Product description.
+        brand : str
+            Product brand.
+
+        Returns
+        -------
+        pd.Series
+           pd.Series([name, product, brand])
+        """
+
+        if name and not brand and self.fuzzy_brands is not None:
+            found = self.__fuzzy_lookup(self.fuzzy_brands, name)
+            if found:
+                word, brand = found
+                name = " ".join(x for x in name.split() if x != word)
+
+        if name and not product and self.fuzzy_products is not None:
+            found = self.__fuzzy_lookup(self.fuzzy_products, name)
+            if found:
+                product = found[1]
+        return pd.Series([name, product, brand])
+
     def _use_mystem(self, name: str, product: str) -> str:
         """
         Use Yandex pymystem3 library to lemmatize words in product descriptions.
@@ -241,7 +398,9 @@ class Finder:
         """
 
         if name and not product:
-            name = "".join(self.mystem.lemmatize(name)[:-1])
+            with self.mystem_lock:
+                lemmas = self.mystem.lemmatize(name)
+            name = "".join(lemmas[:-1])
         return name
 
     def find_category(self, name: str, product: str, category: str) -> pd.Series:
@@ -268,10 +427,36 @@ class Finder:
             if len(tmp):
                 category = tmp["category"].values[0]
             else:
-                category = self.cat_model.predict(name)
+                category = self.predict_categories([name])[0]
 
         return pd.Series([product, category])
 
+    def predict_categories(self, names: List[str]) -> List[str]:
+        """
+        Predict categories of descriptions with the model.
+        Predictions with a score below `min_confidence` are `UNCERTAIN`.
+
+        Parameters
+        ----------
+        names : List[str]
+            Product names.
+
+        Returns
+        -------
+        List[str]
+            Category of each name.
+        """
+
+        if self.min_confidence is None:
+            return self.cat_model.predict_batch(names)
+        labels, scores = self.cat_model.predict_top_k(names, k=1)
+        return [
+            self.cat_model.categories[label]
+            if score >= self.min_confidence
+            else UNCERTAIN
+            for label, score in zip(labels[:, 0], scores[:, 0])
+        ]
+
     def find_product_by_brand(
         self, product: str, brand: str, category: str
     ) -> pd.Series:
@@ -296,27 +481,27 @@ class Finder:
         """
 
         if brand and not product:
-            single_brand_goods = self.all_clean[self.all_clean["Бренд"] == brand]
-            if len(single_brand_goods):
-                product = single_brand_goods["Продукт"].value_counts().index[0]
-                category = single_brand_goods["Категория"].value_counts().index[0]
+            goods = self.brand_goods.get(brand)
+            if goods:
+                product, category = goods
 
         return pd.Series([product, brand, category])
 
-    def __print_logs(self, message: str, verbose: int) -> None:
+    @staticmethod
+    def __print_logs(message: str, data: pd.DataFrame, verbose: int) -> None:
         """
         Print the number of recognized brands,
         categories and names of goods.
         """
 
         if verbose:
-            _len = len(self.data)
+            _len = len(data)
             print(message)
             print(
                 "Recognized brands: "
-                f"{len(self.data['brand_norm'].dropna())}/{_len}, "
-                f"products: {len(self.data['product_norm'].dropna())}/{_len}, "
-                f"categories: {len(self.data['cat_norm'].dropna())}/{_len}",
+                f"{len(data['brand_norm'].dropna())}/{_len}, "
+                f"products: {len(data['product_norm'].dropna())}/{_len}, "
+                f"categories: {len(data['cat_norm'].dropna())}/{_len}",
                 "-" * 80,
                 sep="\n",
                 end="\n\n",
@@ -341,59 +526,120 @@ class Finder:
                 data[col] = None
         return data
 
-    def __find_all(self, verbose: int) -> None:
-        self.__print_logs("Before:", verbose)
+    def find_in_dicts(
+        self, data: Union[pd.DataFrame, str], verbose: int = 0
+    ) -> pd.DataFrame:
+        """
+        The first stage of `find_all`: search brands and products
+        in the datasets by the words of descriptions.
+        Adds the `candidates` column used by the next stage.
+        """
+
+        data = self.__transform_data(data)
+        self.__print_logs("Before:", data, verbose)
+
+        # Split descriptions into words once for all search stages:
+        data["candidates"] = [
+            Candidates(name, self.candidates_policy) for name in data["name_norm"]
+        ]
 
         # Find brands:
-        self.data[["name_norm", "brand_norm"]] = self.data[
-            ["name_norm", "brand_norm"]
-        ].appl(self.find_brands)
-        self.__print_logs("Find brands:", verbose)
+        data[["name_norm", "brand_norm"]] = df_apply(
+            data[["name_norm", "brand_norm", "candidates"]], self.find_brands
+        )
+        self.__print_logs("Find brands:", data, verbose)
 
         # Find product and category:
-        self.data[["name_norm", "product_norm", "cat_norm"]] = self.data[
-            ["name_norm", "product_norm"]
-        ].appl(self.find_product)
-        self.__print_logs("Find product and category:", verbose)
+        data[["name_norm", "product_norm", "cat_norm"]] = df_apply(
+            data[["name_norm", "product_norm", "cat_norm", "candidates"]],
+            self.find_product,
+        )
+        self.__print_logs("Find product and category:", data, verbose)
 
         # Remove `-`:
-        self.data["name_norm"] = self.data["name_norm"].str.replace("-", " ")
-        self.data[["name_norm", "product_norm", "cat_norm"]] = self.data[
-            ["name_norm", "product_norm", "cat_norm"]
-        ].appl(self.find_product)
+        data["name_norm"] = data["name_norm"].str.replace("-", " ")
+        data[["name_norm", "product_norm", "cat_norm"]] = df_apply(
+            data[["name_norm", "product_norm", "cat_norm", "candidates"]],
+            self.find_product,
+        )
         self.__print_logs(
-            "Remove `-` and the second attempt to find a product:", verbose
+            "Remove `-` and the second attempt to find a product:", data, verbose
         )
 
-        # Use Mystem:
-        self.data["name_norm"] = self.data[["name_norm", "product_norm"]].appl(
-            self._use_mystem
+        # Find products and brands with typos:
+        if self.fuzzy_products is not None:
+            data[["name_norm", "product_norm", "brand_norm"]] = df_apply(
+                data[["name_norm", "product_norm", "brand_norm"]], self.find_fuzzy
+            )
+            self.__print_logs("Fuzzy search of products and brands:", data, verbose)
+        return data
+
+    def find_with_mystem(self, data: pd.DataFrame, verbose: int = 0) -> pd.DataFrame:
+        """
+        The second stage of `find_all`: lemmatize descriptions
+        without a product with Mystem and search products again.
+        """
+
+        if "candidates" not in data.columns:
+            data["candidates"] = None
+        data["name_norm"] = df_apply(
+            data[["name_norm", "product_norm"]], self._use_mystem
         )
-        self.data[["name_norm", "product_norm", "cat_norm"]] = self.data[
-            ["name_norm", "product_norm", "cat_norm"]
-        ].appl(self.find_product)
+        data[["name_norm", "product_norm", "cat_norm"]] = df_apply(
+            data[["name_norm", "product_norm", "cat_norm", "candidates"]],
+            self.find_product,
+        )
+        data = data.drop("candidates", axis=1)
         self.__print_logs(
             "Use Mystem for lemmatization and the third attempt to find a product:",
+            data,
             verbose,
         )
+        return data
+
+    def find_with_model(self, data: pd.DataFrame, verbose: int = 0) -> pd.DataFrame:
+        """
+        The last stage of `find_all`: predict the remaining
+        categories with the model and assign products by brands.
+        """
+
+        # Predict categories of unknown products in one batch:
+        known = set(self.products["product"])
+        rows = [
+            i
+            for i, (product, category) in enumerate(
+                zip(data["product_norm"], data["cat_norm"])
+            )
+            if product and not category and product not in known
+        ]
+        if rows:
+            categories = self.predict_categories(data["name_norm"].iloc[rows].tolist())
+            data.iloc[rows, data.columns.get_loc("cat_norm")] = categories
 
         # Find category:
-        self.data[["product_norm", "cat_norm"]] = self.data[
-            ["name_norm", "product_norm", "cat_norm"]
-        ].appl(self.find_category)
-        self.__print_logs("Find the remaining categories:", verbose)
+        data[["product_norm", "cat_norm"]] = df_apply(
+            data[["name_norm", "product_norm", "cat_norm"]], self.find_category
+        )
+        self.__print_logs("Find the remaining categories:", data, verbose)
 
         # Find product by brand:
-        self.data[["product_norm", "brand_norm", "cat_norm"]] = self.data[
-            ["product_norm", "brand_norm", "cat_norm"]
-        ].appl(self.find_product_by_brand)
-        self.__print_logs("Find product by brand:", verbose)
+        data[["product_norm", "brand_norm", "cat_norm"]] = df_apply(
+            data[["product_norm", "brand_norm", "cat_norm"]],
+            self.find_product_by_brand,
+        )
+        self.__print_logs("Find product by brand:", data, verbose)
+        return data
 
     def find_all(
         self, data: Union[pd.DataFrame, str], verbose: int = 0
     ) -> pd.DataFrame:
         """
         Start search and recognition search processes in `data`.
+        The method doesn't change the state of the instance,
+        so it can be called from several threads at once.
+        It runs `find_in_dicts`, `find_with_mystem` and `find_with_model`
+        one after the other, see `receipt_parser.pipeline.Pipeline`
+        to run them concurrently on different chunks.
 
         Parameters
         ----------
@@ -410,7 +656,6 @@ class Finder:
             Recognized product names, brands and product categories.
         """
 
-        self.data = self.__transform_data(data)
-        self.__find_all(verbose)
-
-        return self.data
+        data = self.find_in_dicts(data, verbose)
+        data = self.find_with_mystem(data, verbose)
+        return self.find_with_model(data, verbose)
@@ -0,0 +1,138 @@
+"""
+Typo-tolerant lookup in lexicons with a symmetric deletion index (SymSpell):
+all variants of lexicon words with up to `max_distance` deleted characters
+are precomputed, so a lookup only generates deletions of the query and
+probes the index instead of comparing the query with every word.
+"""
+from itertools import combinations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+Match = NamedTuple("Match", [("term", str), ("distance", int), ("confidence", float)])
+
+
+def _deletions(word: str, max_distance: int) -> Set[str]:
+    """All variants of the word with up to `max_distance` deleted characters."""
+
+    variants = {word}
+    for distance in range(1, min(max_distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), distance):
+            variants.add("".join(c for i, c in enumerate(word) if i not in positions))
+    return variants
+
+
+def edit_distance(first: str, second: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance: insertions, deletions,
+    substitutions and transpositions of adjacent characters.
+    Returns `max_distance + 1` if the distance is greater than `max_distance`.
+    """
+
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous2: List[int] = []
+    previous = list(range(len(second) + 1))
+    for i, char1 in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, char2 in enumerate(second, 1):
+            cost = 0 if char1 == char2 else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and char1 == second[j - 2] and first[i - 2] == char2:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class DeletionIndex:
+    """
+    Find the closest lexicon term to a possibly misspelled word.
+
+    Parameters
+    ----------
+    terms : Iterable[str]
+        Lexicon terms. Earlier terms win ties of equal distance.
+    max_distance : int, (default=2)
+        Maximum edit distance of a lookup.
+    min_length : int, (default=5)
+        Shorter terms are only matched exactly: one edit in a
+        short word usually gives another real word.
+
+    Examples
+    --------
+    >>> index = DeletionIndex(['напиток', 'молоко'])
+    >>> index.lookup('напитк')
+    Match(term='напиток', distance=1, confidence=0.857...)
+    """
+
+    def __init__(
+        self, terms: Iterable[str], max_distance: int = 2, min_length: int = 5
+    ):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.terms: Dict[str, int] = {}
+        self.index: Dict[str, List[str]] = {}
+        for term in terms:
+            if not isinstance(term, str) or term in self.terms:
+                continue
+            self.terms[term] = len(self.terms)
+            if len(term) < min_length:
+                continue
+            for variant in _deletions(term, max_distance):
+                self.index.setdefault(variant, []).append(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def allowed_distance(self, word: str) -> int:
+        """
+        One edit for each four characters, but not more than `max_distance`.
+        A word one character shorter than `min_length` can still be
+        a term with a deleted character.
+        """
+
+        if len(word) < self.min_length - 1:
+            return 0
+        return min(self.max_distance, max(len(word) // 4, 1))
+
+    def lookup(self, word: str) -> Optional[Match]:
+        """
+        Find the closest term within the allowed distance.
+
+        Confidence is `1 - distance / len(term)` divided by the number
+        of different terms at the same distance, so an ambiguous
+        correction gets a low confidence.
+
+        Returns
+        -------
+        Optional[Match]
+            The closest term or None if there is no term close enough.
+        """
+
+        if word in self.terms:
+            return Match(word, 0, 1.0)
+        max_distance = self.allowed_distance(word)
+        if not max_distance:
+            return None
+
+        best: List[str] = []
+        best_distance = max_distance + 1
+        seen: Set[str] = set()
+        for variant in _deletions(word, max_distance):
+            for term in self.index.get(variant, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(word, term, max_distance)
+                if distance < best_distance:
+                    best, best_distance = [term], distance
+                elif distance == best_distance:
+                    best.append(term)
+
+        if not best:
+            return None
+        term = min(best, key=self.terms.__getitem__)
+        confidence = (1 - best_distance / len(term)) / len(best)
+        return Match(term, best_distance, confidence)
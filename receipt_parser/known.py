@@ -0,0 +1,156 @@
+"""Table of already labelled product descriptions for exact matching."""
+import pickle
+from typing import Dict, Iterable, Optional, Tuple
+import pandas as pd  # type: ignore
+
+Label = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class KnownDescriptions:
+    """
+    Map raw product descriptions to the already known product,
+    brand and category. Descriptions are normalized (lowercase,
+    single spaces) and looked up by hash, so recognized lines skip
+    `Normalizer` and `Finder` completely.
+
+    Parameters
+    ----------
+    table: Optional[Dict[str, Label]], (default=None)
+        Compiled table: normalized description -> (product, brand, category).
+
+    Attributes
+    ----------
+    columns: Tuple[str, ...]
+        Names of the result columns.
+
+    Examples
+    --------
+    >>> known = KnownDescriptions.from_csv('data/cleaned/all_clean.csv')
+    >>> known.add(['Нап.пив.ХУГАР.ГРЕЙПФ.н/ф 0.47л'], ['напиток, пиво'],
+    ...           ['hoegaarden'], ['Воды, соки, напитки'])
+    >>> known.save('known.pkl')
+    """
+
+    columns: Tuple[str, ...] = ("product_norm", "brand_norm", "cat_norm")
+
+    def __init__(self, table: Optional[Dict[str, Label]] = None):
+        self.table: Dict[str, Label] = table or {}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __contains__(self, name: str) -> bool:
+        return self.normalize_key(name) in self.table
+
+    @staticmethod
+    def normalize_key(name: str) -> str:
+        """Lowercase the description and collapse whitespaces."""
+
+        return " ".join(str(name).lower().split())
+
+    @staticmethod
+    def __clean(value) -> Optional[str]:
+        """Replace NaN and empty values with None."""
+
+        if pd.isna(value) or value == "":
+            return None
+        return value
+
+    def add(
+        self,
+        names: Iterable[str],
+        products: Iterable[Optional[str]],
+        brands: Iterable[Optional[str]],
+        categories: Iterable[Optional[str]],
+    ) -> int:
+        """
+        Add verified descriptions to the table in bulk.
+        Existing descriptions are overwritten.
+
+        Parameters
+        ----------
+        names : Iterable[str]
+            Raw product descriptions.
+        products : Iterable[Optional[str]]
+            Product names.
+        brands : Iterable[Optional[str]]
+            Product brands.
+        categories : Iterable[Optional[str]]
+            Product categories.
+
+        Returns
+        -------
+        int
+            Number of added descriptions.
+        """
+
+        count = 0
+        for name, product, brand, category in zip(names, products, brands, categories):
+            if pd.isna(name):
+                continue
+            self.table[self.normalize_key(name)] = (
+                self.__clean(product),
+                self.__clean(brand),
+                self.__clean(category),
+            )
+            count += 1
+        return count
+
+    def add_frame(
+        self,
+        data: pd.DataFrame,
+        name: str = "Название",
+        product: str = "Продукт",
+        brand: str = "Бренд",
+        category: str = "Категория",
+    ) -> int:
+        """
+        Add verified descriptions from a DataFrame,
+        by default in the `all_clean.csv` format.
+        """
+
+        return self.add(data[name], data[product], data[brand], data[category])
+
+    @classmethod
+    def from_csv(cls, path: str, **columns: str) -> "KnownDescriptions":
+        """Create the table from a *.csv file like `all_clean.csv`."""
+
+        known = cls()
+        known.add_frame(pd.read_csv(path), **columns)
+        return known
+
+    @classmethod
+    def load(cls, path: str) -> "KnownDescriptions":
+        """Load the compiled table saved by `save`."""
+
+        with open(path, "rb") as file:
+            return cls(pickle.load(file))
+
+    def save(self, path: str) -> None:
+        """Save the compiled table."""
+
+        with open(path, "wb") as file:
+            pickle.dump(self.table, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def lookup(self, data: pd.Series) -> pd.DataFrame:
+        """
+        Find descriptions in the table.
+
+        Parameters
+        ----------
+        data : pd.Series
+            Raw product descriptions.
+
+        Returns
+        -------
+        pd.DataFrame
+            Labels of the found descriptions only,
+            indexed by their positions in `data`.
+        """
+
+        found = {}
+        for pos, name in enumerate(data.values):
+            label = self.table.get(self.normalize_key(name))
+            if label is not None:
+                found[pos] = label
+        return pd.DataFrame.from_dict(found, orient="index", columns=list(self.columns))
@@ -0,0 +1,344 @@
+"""
+Merge catalogues collected by the parsers into the lexicons:
+`all_clean.csv`, `products.csv`, `brands_ru.csv` and `brands_en.csv`.
+
+Goods are identified by the hash of the normalised description, so
+a rebuild only appends goods which are not in `all_clean.csv` yet and
+only products and brands of these goods. Catalogues which didn't change
+since the previous build are not read at all.
+
+Examples
+--------
+$ python -m receipt_parser.lexicon lexicons \
+    --peterochka peterochka_goods.csv --perecrestok perecrestok_goods.csv
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+try:
+    from receipt_parser.resources import Resources, sha256  # type: ignore
+except ImportError:
+    from resources import Resources, sha256  # type: ignore
+
+FILES = {
+    "all_clean": "all_clean.csv",
+    "products": "products.csv",
+    "brands_ru": "brands_ru.csv",
+    "brands_en": "brands_en.csv",
+}
+COLUMNS = ["Название", "Продукт", "Бренд", "Категория"]
+STATE = "lexicon_state.json"
+KEYS = "all_clean.keys.npy"
+
+LexiconDiff = NamedTuple(
+    "LexiconDiff",
+    [
+        ("skipped", List[str]),
+        ("rows", int),
+        ("duplicates", int),
+        ("added", int),
+        ("products", Dict[str, str]),
+        ("conflicts", Dict[str, Tuple[str, str]]),
+        ("brands_ru", List[str]),
+        ("brands_en", List[str]),
+        ("hashes", Dict[str, str]),
+    ],
+)
+
+
+def _normalize(column: pd.Series) -> pd.Series:
+    """Lower case without repeated and trailing spaces."""
+
+    return column.str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def name_keys(names: pd.Series) -> np.ndarray:
+    """64-bit hashes of normalised descriptions, equal for duplicates."""
+
+    return pd.util.hash_pandas_object(_normalize(names), index=False).values
+
+
+def read_catalogue(path: str, source: str, products: Set[str]) -> pd.DataFrame:
+    """
+    Read a catalogue of a parser and convert it to the columns of
+    `all_clean.csv`: `Название`, `Продукт`, `Бренд`, `Категория`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the *.csv file.
+    source : str
+        - `peterochka`: has all the columns after `ParseProductName`;
+        - `perecrestok`: the brand is `Торговая марка`, the product is
+          the first word of the description if it is a known product;
+        - `all_clean`: already has the columns, e.g. labelled by hand.
+    products : Set[str]
+        Known products.
+    """
+
+    data = pd.read_csv(path, dtype=str)
+    if source == "perecrestok":
+        data = data.rename(columns={"Торговая марка": "Бренд"})
+        first_word = _normalize(data["Название"]).str.split(" ").str[0]
+        data["Продукт"] = first_word.where(first_word.isin(products))
+    elif source not in ("peterochka", "all_clean"):
+        raise ValueError(f"Неизвестный источник каталога: `{source}`.")
+
+    missing = set(COLUMNS) - set(data.columns)
+    if missing:
+        raise KeyError(f"В каталоге `{path}` нет колонок: {', '.join(missing)}.")
+    data = data[COLUMNS].dropna(subset=["Название", "Бренд", "Категория"])
+    data["Название"] = data["Название"].str.strip()
+    data["Продукт"] = _normalize(data["Продукт"])
+    data["Бренд"] = _normalize(data["Бренд"])
+    return data[data["Бренд"] != ""]
+
+
+def _append_csv(path: str, data: pd.DataFrame) -> None:
+    """Append rows to a *.csv file without rewriting it."""
+
+    if data.empty:
+        return
+    if os.path.getsize(path):
+        with open(path, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+    data.to_csv(path, mode="a", header=False, index=False)
+
+
+def _most_common(data: pd.DataFrame, key: str, value: str) -> Dict[str, str]:
+    """The most common value for each key, the first one of equally common."""
+
+    counts = data.groupby([key, value], sort=False).size().reset_index(name="n")
+    counts = counts.sort_values("n", ascending=False, kind="stable")
+    return dict(counts.drop_duplicates(key).set_index(key)[value])
+
+
+class LexiconBuilder:
+    """
+    Update the lexicons in a directory with new catalogues.
+
+    The directory keeps `lexicon_state.json` with hashes of merged
+    catalogues and of the lexicons, and `all_clean.keys.npy` with sorted
+    hashes of descriptions of `all_clean.csv`. The keys are computed again
+    only if `all_clean.csv` was changed by someone else.
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory with the lexicons. Missing lexicons are copied from
+        `pathes` or from the package data.
+    pathes : Optional[Dict[str, str]], (default=None)
+        Paths to the initial lexicons, see `resources.Resources.resolve`.
+    """
+
+    def __init__(self, out_dir: str, pathes: Optional[Dict[str, str]] = None):
+        self.out_dir = out_dir
+        self.pathes = {
+            name: os.path.join(out_dir, file) for name, file in FILES.items()
+        }
+        missing = [
+            name for name, path in self.pathes.items() if not os.path.exists(path)
+        ]
+        if missing:
+            os.makedirs(out_dir, exist_ok=True)
+            initial = Resources().resolve(pathes, names=missing)
+            for name in missing:
+                shutil.copyfile(initial[name], self.pathes[name])
+
+    def __load_state(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(os.path.join(self.out_dir, STATE), "r", encoding="UTF-8") as file:
+                state: Dict[str, Dict[str, str]] = json.load(file)
+            return state
+        except (OSError, ValueError):
+            return {"sources": {}, "files": {}}
+
+    def __save_state(self, state: Dict[str, Dict[str, str]]) -> None:
+        path = os.path.join(self.out_dir, STATE)
+        with open(f"{path}.tmp", "w", encoding="UTF-8") as file:
+            json.dump(state, file, ensure_ascii=False, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+    def keys(self, state: Dict[str, Dict[str, str]]) -> np.ndarray:
+        """Sorted hashes of descriptions of `all_clean.csv`."""
+
+        path = os.path.join(self.out_dir, KEYS)
+        if os.path.exists(path) and state["files"].get("all_clean") == sha256(
+            self.pathes["all_clean"]
+        ):
+            return np.load(path)
+        names = pd.read_csv(self.pathes["all_clean"], usecols=["Название"], dtype=str)
+        return np.unique(name_keys(names["Название"].dropna()))
+
+    def __add_brands(self, brands: pd.Series) -> Tuple[List[str], List[str]]:
+        """Append new Russian brands and brands in Latin letters."""
+
+        result = []
+        is_russian = brands.str.contains("[а-яё]", regex=True)
+        for name, new in (
+            ("brands_ru", brands[is_russian]),
+            ("brands_en", brands[~is_russian]),
+        ):
+            known = set(pd.read_csv(self.pathes[name], dtype=str)["brand"])
+            added = [brand for brand in pd.unique(new) if brand not in known]
+            _append_csv(self.pathes[name], pd.DataFrame({"brand": added}))
+            result.append(added)
+        return result[0], result[1]
+
+    @staticmethod
+    def __read(
+        catalogues: Dict[str, str], state: Dict[str, Dict[str, str]], products: Set[str]
+    ) -> Tuple[pd.DataFrame, Dict[str, str]]:
+        """
+        Read catalogues which changed since they were merged.
+        Return them and their hashes by absolute paths.
+        """
+
+        frames, merged = [], {}
+        for path, source in catalogues.items():
+            digest = sha256(path)
+            if state["sources"].get(os.path.abspath(path)) != digest:
+                frames.append(read_catalogue(path, source, products))
+                merged[os.path.abspath(path)] = digest
+        data = pd.concat(frames) if frames else pd.DataFrame(columns=COLUMNS)
+        return data, merged
+
+    def __add_products(
+        self, goods: pd.DataFrame, known: Dict[str, str]
+    ) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
+        """
+        Append new products with their most common categories.
+        Return them and known products which are more common
+        in another category now.
+        """
+
+        categories = _most_common(
+            goods.dropna(subset=["Продукт"]), "Продукт", "Категория"
+        )
+        added = {
+            product: category
+            for product, category in categories.items()
+            if product not in known
+        }
+        conflicts = {
+            product: (known[product], category)
+            for product, category in categories.items()
+            if product in known and known[product] != category
+        }
+        _append_csv(
+            self.pathes["products"],
+            pd.DataFrame({"product": list(added), "category": list(added.values())}),
+        )
+        return added, conflicts
+
+    def update(self, catalogues: Dict[str, str]) -> LexiconDiff:
+        """
+        Merge catalogues into the lexicons.
+
+        Parameters
+        ----------
+        catalogues : Dict[str, str]
+            Sources of catalogues by their paths, see `read_catalogue`.
+
+        Returns
+        -------
+        LexiconDiff
+            Skipped unchanged catalogues, numbers of read, duplicated
+            and added goods, added products with their categories,
+            products which are more common in another category now
+            (they are not changed), added brands and new hashes of
+            the lexicons.
+        """
+
+        state = self.__load_state()
+        products = pd.read_csv(self.pathes["products"], dtype=str)
+        known_products = dict(zip(products["product"], products["category"]))
+        data, merged = self.__read(catalogues, state, set(known_products))
+
+        keys = self.keys(state)
+        data["key"] = name_keys(data["Название"])
+        new = data.drop_duplicates("key")
+        new = new[~np.isin(new["key"].values, keys)]
+        _append_csv(self.pathes["all_clean"], new[COLUMNS])
+        added_products, conflicts = self.__add_products(new, known_products)
+        brands_ru, brands_en = self.__add_brands(new["Бренд"])
+
+        hashes = {name: sha256(path) for name, path in self.pathes.items()}
+        np.save(os.path.join(self.out_dir, KEYS), np.union1d(keys, new["key"].values))
+        state["sources"].update(merged)
+        state["files"] = hashes
+        self.__save_state(state)
+        return LexiconDiff(
+            [path for path in catalogues if os.path.abspath(path) not in merged],
+            len(data),
+            len(data) - len(new),
+            len(new),
+            added_products,
+            conflicts,
+            brands_ru,
+            brands_en,
+            hashes,
+        )
+
+
+def format_diff(diff: LexiconDiff, limit: int = 20) -> str:
+    """Human-readable report of an update."""
+
+    def sample(items) -> str:
+        items = list(items)
+        more = f" ... (+{len(items) - limit})" if len(items) > limit else ""
+        return ", ".join(map(str, items[:limit])) + more
+
+    lines = [
+        f"Skipped unchanged catalogues: {sample(diff.skipped) or '-'}",
+        f"Goods: read {diff.rows}, duplicates {diff.duplicates}, added {diff.added}",
+        f"Products added ({len(diff.products)}): "
+        + sample(
+            f"{product} [{category}]" for product, category in diff.products.items()
+        ),
+        f"Products in another category ({len(diff.conflicts)}): "
+        + sample(
+            f"{product} [{old} -> {new}]"
+            for product, (old, new) in diff.conflicts.items()
+        ),
+        f"Russian brands added ({len(diff.brands_ru)}): {sample(diff.brands_ru)}",
+        f"English brands added ({len(diff.brands_en)}): {sample(diff.brands_en)}",
+    ]
+    lines += [f"sha256 {name}: {digest}" for name, digest in diff.hashes.items()]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line interface."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir", help="directory with the lexicons to update")
+    for source in ("peterochka", "perecrestok", "all_clean"):
+        parser.add_argument(
+            f"--{source}", action="append", default=[], help=f"{source} catalogue"
+        )
+    parser.add_argument("--report", help="save the report as JSON")
+    args = parser.parse_args(argv)
+
+    catalogues = {
+        path: source
+        for source in ("peterochka", "perecrestok", "all_clean")
+        for path in getattr(args, source)
+    }
+    diff = LexiconBuilder(args.out_dir).update(catalogues)
+    print(format_diff(diff))
+    if args.report:
+        with open(args.report, "w", encoding="UTF-8") as file:
+            json.dump(diff._asdict(), file, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
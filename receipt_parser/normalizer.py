@@ -1,21 +1,84 @@
 """Normalize product description."""
+import os
 import re
-from typing import Optional, Union, Dict
+import math
+import importlib
+from typing import Optional, Union, Dict, List, NamedTuple, Tuple
 import pandas as pd  # type: ignore
-from pandarallel import pandarallel  # type: ignore
-
-pandarallel.initialize(progress_bar=False, verbose=0)
 
 try:
-    # pylint: disable=line-too-long
-    from receipt_parser.dicts import PRODUCTS, BRANDS, SLASH_PRODUCTS, BRANDS_WITH_NUMBERS  # type: ignore
+    # pylint: disable=consider-using-from-import
+    import receipt_parser.dicts as dicts  # type: ignore
+    from receipt_parser.resources import Resources  # type: ignore
+    from receipt_parser.cost_model import get_cost_model, run_plan, Plan  # type: ignore
+    from receipt_parser.trie import PrefixTrie, build_vocabulary  # type: ignore
 except ModuleNotFoundError:
-    from dicts import PRODUCTS, BRANDS, SLASH_PRODUCTS, BRANDS_WITH_NUMBERS  # type: ignore
+    import dicts  # type: ignore
+    from resources import Resources  # type: ignore
+    from cost_model import get_cost_model, run_plan, Plan  # type: ignore
+    from trie import PrefixTrie, build_vocabulary  # type: ignore
+
+TABLES = ("PRODUCTS", "BRANDS", "SLASH_PRODUCTS", "BRANDS_WITH_NUMBERS")
+
+# Flags of tokens:
+HAS_DIGIT = 1
+IS_LATIN = 2
+
+Token = NamedTuple("Token", [("text", str), ("flags", int)])
+
+_DIGIT = re.compile(r"\d")
+_LATIN = re.compile(r"[a-z]")
+_NUMBERS = re.compile(r"\w*\d\w*")
+_ENGLISH = re.compile(r"\b([a-z]+)\b")
+# Remove `-` after the sentence and remove almost all service chars:
+_PUNCTUATION = re.compile(r"((?<=\w)-+(?!\w))|([.,+!?%:№*/\(|\)])")
+
+
+def tokenize(text: str) -> List[Token]:
+    """
+    Split the text by whitespace like `str.split` and keep flags
+    of the words: `HAS_DIGIT`, `IS_LATIN`.
+    """
+
+    tokens = []
+    for word in text.split():
+        flags = (HAS_DIGIT if _DIGIT.search(word) else 0) | (
+            IS_LATIN if _LATIN.search(word) else 0
+        )
+        tokens.append(Token(word, flags))
+    return tokens
+
+
+def load_tables(reload: bool = False) -> Dict[str, Dict[str, str]]:
+    """
+    Return copies of the tables of `dicts.py` by their names.
+    If `reload` is True, the module is executed again to read its changes.
+    """
+
+    module = importlib.reload(dicts) if reload else dicts
+    return {name: dict(getattr(module, name)) for name in TABLES}
 
 
 # pylint: disable=bad-continuation
 class Apply:
-    """User define the `apply` function from pd.Series and pd.DataFrame"""
+    """
+    User define the `apply` function from pd.Series and pd.DataFrame.
+    By default the cost model decides whether to use threads or processes,
+    see `receipt_parser.cost_model.CostModel`.
+    """
+
+    @staticmethod
+    def _apply(data, func, use_parallel: Optional[bool], key: str, **kwargs):
+        """Apply the function serially, with processes or as the cost model decides."""
+
+        if use_parallel is None:
+            return get_cost_model().apply(data, func, key, **kwargs)
+        if use_parallel:
+            workers = os.cpu_count() or 1
+            plan = Plan("processes", workers, math.ceil(len(data) / workers))
+        else:
+            plan = Plan("serial", 1, len(data))
+        return run_plan(data, func, plan, **kwargs)
 
     @staticmethod
     def series_apply(data: pd.Series, func, use_parallel: Optional[bool] = None):
@@ -29,7 +92,7 @@ class Apply:
         func : function
             Function to apply to each column or row.
         use_parallel : Optional[bool], default=None
-            Multiprocessing will be used if the data size is greater than 30000.
+            Use multiprocessing. By default it is decided by the cost model.
 
         Returns
         -------
@@ -44,11 +107,7 @@ class Apply:
         >>> df['name'].my_apply(foo)
         """
 
-        if use_parallel is None:
-            use_parallel = len(data) >= 10000
-        if use_parallel:
-            return data.parallel_apply(func)
-        return data.apply(func)
+        return Apply._apply(data, func, use_parallel, func.__qualname__)
 
     @staticmethod
     def df_apply(
@@ -65,7 +124,7 @@ class Apply:
         func : function
             Function to apply to each column or row.
         use_parallel : Optional[bool], default=None
-            Multiprocessing will be used if the data size is greater than 30000.
+            Use multiprocessing. By default it is decided by the cost model.
         axis : {0 or 'index', 1 or 'columns'}, default=1
             Axis along which the function is applied.
 
@@ -84,14 +143,13 @@ class Apply:
 
         _cols = data.columns
 
-        if use_parallel is None:
-            use_parallel = len(data) >= 10000
-
-        if use_parallel:
-            return data.parallel_apply(
-                lambda x: func(x[_cols[0]], x[_cols[1]]), axis=axis
-            )
-        return data.apply(lambda x: func(x[_cols[0]], x[_cols[1]]), axis=axis)
+        return Apply._apply(
+            data,
+            lambda x: func(x[_cols[0]], x[_cols[1]]),
+            use_parallel,
+            func.__qualname__,
+            axis=axis,
+        )
 
 
 class Normalizer:
@@ -107,18 +165,41 @@ class Normalizer:
     5. Find English brands using the dataset `brands_en.csv`;
     6. Delete words from blacklist and words in English;
     7. Replace words using `dicts.PRODUCTS`.
+    Steps which work with separate words share tokens with flags,
+    see `tokenize`. Steps which search substrings or run regular
+    expressions across words work with the joined string, so it is
+    split into tokens again after steps 2, 3 and 5.
 
     Parameters
     ----------
     pathes: Optional[Dict[str, str]], (default=None)
-        Dictionary with paths to *.csv files.
+        Dictionary with paths to *.csv files. Missing files are
+        searched in the package data and in the cache,
+        see `receipt_parser.resources.Resources`.
+    use_parallel: Optional[bool], (default=None)
+        Use multiprocessing for normalization. By default it is decided
+        by the cost model, see `receipt_parser.cost_model`.
+    tables: Optional[Dict[str, Dict[str, str]]], (default=None)
+        Tables of abbreviations by their names in `dicts.py`,
+        see `load_tables`. The tables of `dicts.py` by default.
+    expand_prefixes: bool, (default=False)
+        Expand truncated words missing in `dicts.PRODUCTS` to the only
+        product of `dicts.PRODUCTS` or `products.csv` which starts with
+        them, see `receipt_parser.trie.PrefixTrie`.
 
     Attributes
     ----------
     blacklist: np.ndarray
         Stop word list.
+    blacklist_set: Set[str]
+        Stop words for fast lookups.
     brands: np.ndarray
         List with  most common English brands.
+    tables: Dict[str, Dict[str, str]]
+        Tables of abbreviations: `PRODUCTS`, `BRANDS`,
+        `SLASH_PRODUCTS` and `BRANDS_WITH_NUMBERS`.
+    trie: Optional[PrefixTrie]
+        Product names to expand truncated words if `expand_prefixes` is set.
 
     Examples
     --------
@@ -127,56 +208,28 @@ class Normalizer:
     >>> norm.normalize(product)
     """
 
-    def __init__(self, pathes: Optional[Dict[str, str]] = None):
-        pathes = pathes or {}
-        self.blacklist = pd.read_csv(pathes.get("blacklist", "data/blacklist.csv"))[
+    def __init__(
+        self,
+        pathes: Optional[Dict[str, str]] = None,
+        use_parallel: Optional[bool] = None,
+        tables: Optional[Dict[str, Dict[str, str]]] = None,
+        expand_prefixes: bool = False,
+    ):
+        names = ["blacklist", "brands_en"] + (["products"] if expand_prefixes else [])
+        pathes = Resources().resolve(pathes, names=names)
+        self.use_parallel = use_parallel
+        self.tables = tables or load_tables()
+        self.trie: Optional[PrefixTrie] = None
+        if expand_prefixes:
+            products = pd.read_csv(pathes["products"], usecols=["product"])["product"]
+            self.trie = PrefixTrie(build_vocabulary(products, self.tables["PRODUCTS"]))
+        self.blacklist = pd.read_csv(pathes["blacklist"], usecols=["name"])[
             "name"
         ].values
-        self.brands = pd.read_csv(
-            pathes.get("brands_en", "data/cleaned/brands_en.csv")
-        )["brand"].values
-
-        # Init user define apply function:
-        pd.DataFrame.appl = Apply.df_apply
-        pd.Series.appl = Apply.series_apply
-
-    @staticmethod
-    def _remove_numbers(name: str) -> pd.Series:
-        """Remove all words in product description which contain numbers."""
-
-        brand = None
-        # Find brands with numbers:
-        for key, value in BRANDS_WITH_NUMBERS.items():
-            if key in name:
-                brand = value
-                name = name.replace(key, "")
-                break
-
-        name = " ".join(re.sub(r"\w*\d\w*", "", word) for word in name.split())
-        return pd.Series([name, brand])
-
-    @staticmethod
-    def _remove_punctuation(name: str, brand: Optional[str]) -> pd.Series:
-        """Remove all service characters in product description."""
-
-        # Find abbreviations:
-        for key, value in BRANDS.items():
-            if key in name:
-                brand = value
-                name = name.replace(key, "")
-                break
-
-        product = None
-        for key, value in SLASH_PRODUCTS.items():
-            if key in name:
-                product = value
-                name = name.replace(key, " ")
-                break
-
-        # Pattern: remove `-` after the sentence and remove almost all service chars
-        pattern = r"((?<=\w)-+(?!\w))|([.,+!?%:№*/\(|\)])"
-        name = re.sub(pattern, " ", name).replace("  ", " ")
-        return pd.Series([name, product, brand])
+        self.blacklist_set = set(self.blacklist)
+        self.brands = pd.read_csv(pathes["brands_en"], usecols=["brand"])[
+            "brand"
+        ].values
 
     def find_en_brands(self, name: str, brand: Optional[str]) -> pd.Series:
         """Find English brands using the dataset `brands_en.csv`."""
@@ -191,35 +244,79 @@ class Normalizer:
         return pd.Series([name, brand])
 
     @staticmethod
-    def _remove_one_and_two_chars(name: str) -> str:
-        """Remove words consisting of 1 or 2 characters."""
+    def _replace_first(
+        name: str, table: Dict[str, str], replacement: str
+    ) -> Tuple[str, Optional[str]]:
+        """Replace the first key of the table found in the name, return its value."""
 
-        return " ".join(x for x in name.split() if len(x) > 2)
+        for key, value in table.items():
+            if key in name:
+                return name.replace(key, replacement), value
+        return name, None
 
-    def _remove_words_in_blacklist(self, name: str) -> str:
-        """Remove words from blacklist."""
+    def _normalize_one(self, name: str) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        Apply steps 2-7 to a lowercased description. Steps which work
+        with words share tokens, the string is joined for steps which
+        search substrings or run regular expressions across words
+        and split again after them.
 
-        return " ".join(word for word in name.split() if word not in self.blacklist)
+        Returns
+        -------
+        Tuple[str, Optional[str], Optional[str]]
+            Normalized description, product and brand.
+        """
 
-    @staticmethod
-    def _replace_with_product_dict(name: str) -> str:
-        """Replace words using `dicts.PRODUCTS`."""
+        tables = self.tables
 
-        return " ".join(PRODUCTS.get(word, word) for word in name.split())
+        # 2. Delete all words including numbers:
+        name, brand = self._replace_first(name, tables["BRANDS_WITH_NUMBERS"], "")
+        name = " ".join(
+            _NUMBERS.sub("", token.text) if token.flags & HAS_DIGIT else token.text
+            for token in tokenize(name)
+        )
 
-    @staticmethod
-    def _remove_all_english_words(name: str, brand: Optional[str]) -> pd.Series:
-        """
-        Remove all English words in the product description.
-        We make the assumption that these words are a brand.
-        """
+        # 3. Delete all service characters:
+        name, abbreviation = self._replace_first(name, tables["BRANDS"], "")
+        if abbreviation is not None:
+            brand = abbreviation
+        name, product = self._replace_first(name, tables["SLASH_PRODUCTS"], " ")
+        name = _PUNCTUATION.sub(" ", name).replace("  ", " ")
 
-        eng_brands = " ".join(re.findall(r"\b([a-z]+)\b", name))
-        name = re.sub(r"\b([a-z]+)\b", "", name)
+        # 4. Delete words consisting of 1 or 2 characters:
+        tokens = [token for token in tokenize(name) if len(token.text) > 2]
 
+        # 5. Find English brands:
+        if not brand:
+            name = " ".join(token.text for token in tokens)
+            for brand_en in self.brands:
+                if brand_en in name:
+                    brand = brand_en
+                    tokens = tokenize(name.replace(brand_en, ""))
+                    break
+
+        # 6-7. Delete words from blacklist, replace words using `dicts.PRODUCTS`
+        # and delete words in English:
+        products = tables["PRODUCTS"]
+        eng_words: List[str] = []
+        words: List[str] = []
+        for token in tokens:
+            word = token.text
+            if word in self.blacklist_set:
+                continue
+            if self.trie is not None:
+                word = self.trie.expand(word, products)
+            else:
+                word = products.get(word, word)
+            if token.flags & IS_LATIN or word != token.text:
+                eng_words.extend(_ENGLISH.findall(word))
+                word = _ENGLISH.sub("", word)
+            words.append(word)
+
+        eng_brands = " ".join(eng_words)
         if eng_brands and not brand:
-            return pd.Series([name, eng_brands])
-        return pd.Series([name, brand])
+            brand = eng_brands
+        return " ".join(words), product, brand
 
     @staticmethod
     def __transform_data(data: Union[pd.Series, str]) -> pd.DataFrame:
@@ -250,17 +347,13 @@ class Normalizer:
 
         data = self.__transform_data(data)
         data["name_norm"] = data["name"].str.lower()
-        data[["name_norm", "brand_norm"]] = data["name_norm"].appl(self._remove_numbers)
-        data[["name_norm", "product_norm", "brand_norm"]] = data[
-            ["name_norm", "brand_norm"]
-        ].appl(self._remove_punctuation)
-        data["name_norm"] = data["name_norm"].appl(self._remove_one_and_two_chars)
-        data[["name_norm", "brand_norm"]] = data[["name_norm", "brand_norm"]].appl(
-            self.find_en_brands
-        )
-        data["name_norm"] = data["name_norm"].appl(self._remove_words_in_blacklist)
-        data["name_norm"] = data["name_norm"].appl(self._replace_with_product_dict)
-        data[["name_norm", "brand_norm"]] = data[["name_norm", "brand_norm"]].appl(
-            self._remove_all_english_words
+        if data.empty:
+            return data
+        result = Apply.series_apply(
+            data["name_norm"], self._normalize_one, self.use_parallel
         )
+        names, products, brands = zip(*result)
+        data["name_norm"] = names
+        data["product_norm"] = products
+        data["brand_norm"] = brands
         return data
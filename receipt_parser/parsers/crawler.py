@@ -0,0 +1,358 @@
+"""
+Shared HTTP machinery of the parsers: a pooled keep-alive session with retries,
+an on-disk response cache and checkpoints of crawl progress.
+
+Pages are cached by the hash of their content, so a recrawl only sends
+conditional requests (`If-None-Match`, `If-Modified-Since`), and an offline
+crawler parses cached pages again without the network:
+
+>>> crawler = Crawler(cache_dir="cache")
+>>> Peterochka(crawler=crawler, checkpoint="peterochka.jsonl").parse()
+>>> Peterochka(crawler=Crawler(cache_dir="cache", offline=True)).parse()
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional
+from urllib.parse import urlsplit
+import requests as req
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry  # type: ignore
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Status of a page missing in the cache of an offline crawler, as `only-if-cached`:
+NOT_CACHED = 504
+
+
+def make_session(
+    pool_size: int = 10,
+    retries: int = 3,
+    backoff: float = 0.5,
+    methods: Iterable[str] = (),
+) -> req.Session:
+    """
+    Create a session which keeps up to `pool_size` connections per host alive
+    and retries connection errors and `RETRY_STATUSES` with exponential backoff:
+    `backoff * 2 ** (retry - 1)` seconds. Only idempotent requests are retried,
+    add `methods` if requests of other methods are idempotent too.
+    """
+
+    retry = Retry(
+        total=retries,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | set(methods),
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,  # The last response is returned to the caller
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = req.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _sha256(data: bytes) -> str:
+    """Hex digest of the data."""
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write to a temporary file and rename it, readers never see a part."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of pages: `objects/ab/abcd...` keeps a body
+    under the sha256 of its content, `urls/ef/efgh...json` keeps validators
+    of the url under the sha256 of the url and refers to the body.
+    Equal pages of different urls are stored once.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the cache.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def __path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.root, kind, digest[:2], digest)
+
+    def entry(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return validators and the hash of the cached page or None."""
+
+        path = self.__path("urls", _sha256(url.encode())) + ".json"
+        try:
+            with open(path, "r", encoding="UTF-8") as file:
+                entry: Dict[str, Any] = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.__path("objects", entry["content"])):
+            return None
+        return entry
+
+    def body(self, entry: Dict[str, Any]) -> bytes:
+        """Return the cached body of the entry."""
+
+        with open(self.__path("objects", entry["content"]), "rb") as file:
+            return file.read()
+
+    def store(self, url: str, body: bytes, headers: Mapping[str, str]) -> None:
+        """Save the body and its validators: `ETag`, `Last-Modified`."""
+
+        digest = _sha256(body)
+        path = self.__path("objects", digest)
+        if not os.path.exists(path):
+            _write_atomic(path, body)
+        entry = {
+            "url": url,
+            "content": digest,
+            "fetched": time.time(),
+            "headers": {
+                key: headers[key]
+                for key in ("Content-Type", "ETag", "Last-Modified")
+                if key in headers
+            },
+        }
+        data = json.dumps(entry, ensure_ascii=False).encode()
+        _write_atomic(self.__path("urls", _sha256(url.encode())) + ".json", data)
+
+
+class Checkpoint:
+    """
+    Results of finished parts of a crawl: categories, pages or products.
+    Each result is appended to a JSON lines file as soon as the part is
+    finished, so a crawl stopped by an error or a crash continues from
+    the unfinished parts. A line cut by a crash is ignored.
+
+    Parameters
+    ----------
+    path : Optional[str], (default=None)
+        JSON lines file of the checkpoint, results are not saved by default.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.results: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        if path:
+            self.load(path)
+
+    def load(self, path: str) -> None:
+        """Add results saved to another file, e.g. by another process."""
+
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="UTF-8") as file:
+            for line in file:
+                try:
+                    key, result = json.loads(line)
+                except ValueError:
+                    continue
+                self.results[key] = result
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def __getitem__(self, key: str) -> Any:
+        return self.results[key]
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def save(self, key: str, result: Any) -> Any:
+        """Remember the result of a finished part and return it."""
+
+        self.save_many({key: result})
+        return result
+
+    def save_many(self, results: Dict[str, Any]) -> None:
+        """Remember results of several finished parts with one write."""
+
+        with self._lock:
+            self.results.update(results)
+            if self.path:
+                lines = "".join(
+                    json.dumps([key, result], ensure_ascii=False) + "\n"
+                    for key, result in results.items()
+                )
+                with open(self.path, "a", encoding="UTF-8") as file:
+                    file.write(f"\n{lines}")
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """
+    Allow not more than `rate` calls of `acquire` per second
+    from all threads together.
+
+    Parameters
+    ----------
+    rate : float
+        Calls per second.
+    burst : int, (default=1)
+        Number of calls allowed at once after a pause.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait for the turn of the call."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1  # Negative tokens reserve the next turns
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Crawler:
+    """
+    Fetch pages from many threads over one pooled session,
+    with not more than `per_host` requests to a host at a time.
+
+    Parameters
+    ----------
+    per_host : int, (default=4)
+        Maximum number of simultaneous requests to a host.
+    pool_size : Optional[int], (default=None)
+        Number of kept-alive connections per host, `per_host` by default.
+    retries : int, (default=3)
+        Number of retries of a failed request.
+    backoff : float, (default=0.5)
+        Backoff factor of retries in seconds.
+    timeout : float, (default=30)
+        Timeout of a request in seconds.
+    cache_dir : Optional[str], (default=None)
+        Directory of the `ResponseCache`, pages are not cached by default.
+    max_age : Optional[float], (default=None)
+        Cached pages younger than `max_age` seconds are used without
+        a request, e.g. to continue a crawl. Older pages are revalidated.
+    offline : bool, (default=False)
+        Only use cached pages, a missing one gets status `NOT_CACHED`.
+    """
+
+    # pylint: disable=bad-continuation,too-many-arguments
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        per_host: int = 4,
+        pool_size: Optional[int] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+        cache_dir: Optional[str] = None,
+        max_age: Optional[float] = None,
+        offline: bool = False,
+    ):
+        if offline and not cache_dir:
+            raise ValueError("Для работы без сети нужен `cache_dir`.")
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_age = max_age
+        self.offline = offline
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.session = make_session(pool_size or per_host, retries, backoff)
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def limit(self, url: str) -> Iterator[None]:
+        """Wait for a free slot of the host of the url."""
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            slots = self._hosts.setdefault(
+                host, threading.BoundedSemaphore(self.per_host)
+            )
+        with slots:
+            yield
+
+    @staticmethod
+    def __response(url: str, status: int, body: bytes, headers: Dict) -> req.Response:
+        """Build a response of a cached page."""
+
+        resp = req.Response()
+        resp.url = url
+        resp.status_code = status
+        resp._content = body  # pylint: disable=protected-access
+        resp.headers = CaseInsensitiveDict(headers)
+        resp.encoding = req.utils.get_encoding_from_headers(resp.headers)
+        return resp
+
+    def get(self, url: str, **kwargs) -> req.Response:
+        """
+        Send a GET request within the limit of the host.
+        A 200 response is cached, a 304 one is replaced with the cached page.
+        Pages requested with `params` are cached by the url with them.
+        """
+
+        if self.cache is None:
+            kwargs.setdefault("timeout", self.timeout)
+            with self.limit(url):
+                return self.session.get(url, **kwargs)
+
+        key = url
+        if kwargs.get("params"):
+            key = req.Request("GET", url, params=kwargs["params"]).prepare().url or url
+        entry = self.cache.entry(key)
+        if entry is not None and (
+            self.offline
+            or (
+                self.max_age is not None
+                and time.time() - entry["fetched"] < self.max_age
+            )
+        ):
+            return self.__response(key, 200, self.cache.body(entry), entry["headers"])
+        if self.offline:
+            return self.__response(key, NOT_CACHED, b"", {})
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if entry is not None:
+            if "ETag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        kwargs.setdefault("timeout", self.timeout)
+        with self.limit(url):
+            resp = self.session.get(url, headers=headers, **kwargs)
+
+        if resp.status_code == 304 and entry is not None:
+            body = self.cache.body(entry)
+            validators = CaseInsensitiveDict(entry["headers"])
+            validators.update(resp.headers)
+            self.cache.store(key, body, validators)
+            return self.__response(key, 200, body, entry["headers"])
+        if resp.status_code == 200:
+            self.cache.store(key, resp.content, resp.headers)
+        return resp
+
+    def store(self, url: str, text: str) -> None:
+        """Cache a page obtained in another way, e.g. rendered by a browser."""
+
+        if self.cache is not None:
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+            self.cache.store(url, text.encode("UTF-8"), headers)
@@ -0,0 +1,212 @@
+"""
+Local HTTP server with recorded pages to run the parsers without the network.
+
+A page of `http://host/katalog/bakaleya?page=0` is stored in
+`<root>/katalog/bakaleya@page=0.html`, a missing page gets 404.
+Pages have an `ETag`, so conditional requests of a cached page get 304.
+`LabellerServer` is a stand-in of a labelling service for `labelling.py`.
+
+Examples
+--------
+>>> record("http://pyaterochkaakcii.ru/katalog/bakaleya?page=0", "fixtures")
+>>> with FixtureServer("fixtures") as server:
+...     data = Peterochka(base_url=server.url).parse()
+"""
+import os
+import json
+import hashlib
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+import requests as req
+import pandas as pd  # type: ignore
+
+try:
+    from receipt_parser.parsers.titles import extract_titles  # type: ignore
+except ImportError:
+    from titles import extract_titles  # type: ignore
+
+
+def fixture_path(root: str, url: str) -> str:
+    """Path of the recorded page of the url (or of the path with a query)."""
+
+    parts = urlsplit(url)
+    name = parts.path.strip("/") or "index"
+    if parts.query:
+        name = f"{name}@{parts.query}"
+    return os.path.join(root, *f"{name}.html".split("/"))
+
+
+def record(url: str, root: str, session: Optional[req.Session] = None) -> str:
+    """Download the page and save it as a fixture. Return the path."""
+
+    resp = (session or req).get(url, timeout=30)
+    resp.raise_for_status()
+    path = fixture_path(root, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(resp.content)
+    return path
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    """Serve `fixture_path` of the request and don't log requests."""
+
+    root = "."
+    protocol_version = "HTTP/1.1"  # Keep connections of the pool alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = fixture_path(self.root, self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as file:
+            body = file.read()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def stand_in_labels(names: List[str]) -> List[Dict[str, str]]:
+    """Labels of the stand-in service: a brand in quotes and the first word."""
+
+    titles = extract_titles(pd.Series(names, dtype=object)).fillna("")
+    return [
+        {"Название": name, "Продукт": name.split(" ")[0].lower(), "Бренд": brand}
+        for name, brand in zip(names, titles["Бренд"])
+    ]
+
+
+class _LabellerHandler(_Handler):
+    """
+    Label names of a JSON request, fail each `fail_every`-th request.
+    A failed request succeeds when it is retried.
+    """
+
+    label: Callable[[List[str]], List[Dict[str, str]]] = staticmethod(stand_in_labels)
+    fail_every = 0
+    requests = 0
+    failed: Set[bytes] = set()
+    lock = threading.Lock()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer with labels of the names or with 503."""
+
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        request = json.loads(data)
+        with self.lock:
+            type(self).requests += 1
+            fail = (
+                self.fail_every
+                and self.requests % self.fail_every == 0
+                and data not in self.failed
+            )
+            if fail:
+                self.failed.add(data)
+        if fail:
+            self.send_error(503)
+            return
+        body = json.dumps({"results": self.label(request["names"])}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    """Accept all connections of a pool at once."""
+
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class FixtureServer:
+    """
+    Serve recorded pages from `root` on localhost in a background thread.
+
+    Parameters
+    ----------
+    root : str
+        Directory with pages saved by `record`.
+    port : int, (default=0)
+        Port of the server, a free one by default.
+    """
+
+    def __init__(self, root: str, port: int = 0):
+        self._bind(type("Handler", (_Handler,), {"root": root}), port)
+
+    def _bind(self, handler: type, port: int) -> None:
+        """Create the server with the handler class."""
+
+        self.server = _Server(("127.0.0.1", port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base url to pass to a parser instead of the site."""
+
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class LabellerServer(FixtureServer):
+    """
+    Stand-in of a labelling service: `POST {"names": [...]}`
+    gets `{"results": [...]}`, see `labelling.HttpLabeller`.
+
+    Parameters
+    ----------
+    label : Optional[Callable], (default=None)
+        Function to label a batch of names, `stand_in_labels` by default.
+    fail_every : int, (default=0)
+        Answer each `fail_every`-th request with 503 to test retries,
+        a retried request succeeds.
+    port : int, (default=0)
+        Port of the server, a free one by default.
+    """
+
+    # pylint: disable=super-init-not-called,bad-continuation
+    def __init__(
+        self,
+        label: Optional[Callable[[List[str]], List[Dict[str, str]]]] = None,
+        fail_every: int = 0,
+        port: int = 0,
+    ):
+        attributes = {
+            "fail_every": fail_every,
+            "failed": set(),
+            "lock": threading.Lock(),
+        }
+        if label is not None:
+            attributes["label"] = staticmethod(label)
+        self._bind(type("Handler", (_LabellerHandler,), attributes), port)
+
+    @property
+    def requests(self) -> int:
+        """Number of received requests."""
+
+        return self.server.RequestHandlerClass.requests  # type: ignore
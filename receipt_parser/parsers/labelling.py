@@ -0,0 +1,182 @@
+"""
+Label descriptions of goods with an external service: find their products,
+brands and other fields. A `LabellingClient` labels batches of descriptions,
+`label_all` saves the result of each description to a checkpoint and only
+labels descriptions which are not saved, so a labelling can be continued
+with another batch size, another order or changed descriptions.
+
+`HttpLabeller` sends batches as JSON: `POST {"names": ["..."]}` and expects
+`{"results": [{"Продукт": "...", ...}]}` with a result for each name.
+Another protocol is supported by overriding `encode` and `decode`.
+`fixtures.LabellerServer` is a local stand-in service of this protocol.
+
+Examples
+--------
+>>> labeller = HttpLabeller("http://127.0.0.1:8080/label", rate=20)
+>>> results = labeller.label_all(names, checkpoint="labels.jsonl")
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from receipt_parser.parsers.crawler import (  # type: ignore
+        Checkpoint,
+        RateLimiter,
+        make_session,
+    )
+except ImportError:
+    from crawler import Checkpoint, RateLimiter, make_session  # type: ignore
+
+Labels = List[Dict[str, str]]
+
+
+class LabellingClient(ABC):
+    """
+    Interface of a labelling service.
+
+    Parameters
+    ----------
+    batch_size : int, (default=1)
+        Number of descriptions in a request to the service.
+    """
+
+    def __init__(self, batch_size: int = 1):
+        self.batch_size = batch_size
+
+    @abstractmethod
+    def label(self, names: List[str]) -> List[Dict[str, str]]:
+        """Label a batch of descriptions: fields of each description."""
+
+    def _label_batches(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[List[str], Labels]]:
+        """Label batches one by one, yield them with their results."""
+
+        for names in batches:
+            yield names, self.label(names)
+
+    def label_all(
+        self,
+        names: List[str],
+        checkpoint: Optional[str] = None,
+        resume: Sequence[str] = (),
+    ) -> List[Dict[str, str]]:
+        """
+        Label all descriptions in batches of `batch_size`.
+
+        Parameters
+        ----------
+        names : List[str]
+            Descriptions of goods.
+        checkpoint : Optional[str], (default=None)
+            JSON lines file to save results of descriptions. Labelling
+            started again with the same checkpoint only labels the rest.
+        resume : Sequence[str], (default=())
+            Other checkpoints with labelled descriptions,
+            e.g. of other processes.
+
+        Returns
+        -------
+        List[Dict[str, str]]
+            Fields of each description in the order of `names`.
+        """
+
+        done = Checkpoint(checkpoint)
+        for path in resume:
+            done.load(path)
+        todo = [name for name in dict.fromkeys(names) if name not in done]
+        batches = [
+            todo[start : start + self.batch_size]
+            for start in range(0, len(todo), self.batch_size)
+        ]
+        for batch, result in self._label_batches(batches):
+            done.save_many(dict(zip(batch, result)))
+        return [done[name] for name in names]
+
+
+class HttpLabeller(LabellingClient):
+    """
+    Label batches with JSON requests sent concurrently over
+    a pooled session, not more than `rate` requests per second.
+
+    Parameters
+    ----------
+    url : str
+        Url of the service.
+    batch_size : int, (default=50)
+        Number of descriptions in a request.
+    workers : int, (default=8)
+        Number of requests at a time.
+    rate : Optional[float], (default=None)
+        Maximum number of requests per second, unlimited by default.
+    retries : int, (default=3)
+        Number of retries of a failed request with a backoff.
+    timeout : float, (default=60)
+        Timeout of a request in seconds.
+    """
+
+    # pylint: disable=bad-continuation,too-many-arguments
+    def __init__(
+        self,
+        url: str,
+        batch_size: int = 50,
+        workers: int = 8,
+        rate: Optional[float] = None,
+        retries: int = 3,
+        timeout: float = 60,
+    ):
+        super().__init__(batch_size)
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate) if rate else None
+        # Labelling is idempotent, so POST requests are retried too:
+        self.session = make_session(workers, retries, methods=["POST"])
+
+    @staticmethod
+    def encode(names: List[str]) -> Dict[str, Any]:
+        """Body of a request."""
+
+        return {"names": names}
+
+    @staticmethod
+    def decode(response: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Results of a response."""
+
+        results: List[Dict[str, str]] = response["results"]
+        return results
+
+    def label(self, names: List[str]) -> List[Dict[str, str]]:
+        if self.limiter is not None:
+            self.limiter.acquire()
+        resp = self.session.post(
+            self.url, json=self.encode(names), timeout=self.timeout
+        )
+        if resp.status_code != 200:
+            raise ValueError(
+                f"Сервис разметки вернул код {resp.status_code}: {resp.text[:200]}"
+            )
+        results = self.decode(resp.json())
+        if len(results) != len(names):
+            raise ValueError("Сервис разметки вернул не все результаты.")
+        return results
+
+    def _label_batches(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[List[str], Labels]]:
+        """
+        Label batches concurrently and yield them as soon as they are ready.
+        If a batch fails, the others are finished first, then the error is raised.
+        """
+
+        error: Optional[BaseException] = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.label, names): names for names in batches}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                yield futures[future], future.result()
+        if error is not None:
+            raise error
@@ -1,16 +1,30 @@
 """Parse info about Magnit supremarket in Edadil story: `https://edadeal.ru/`."""
 from time import sleep
-from typing import List
+from typing import List, Optional
 from selenium import webdriver  # type: ignore
 
+try:
+    from receipt_parser.parsers.crawler import Checkpoint  # type: ignore
+except ImportError:
+    from crawler import Checkpoint  # type: ignore
+
 
 class Magnit:
-    """Parse olnly product's names."""
+    """
+    Parse olnly product's names.
+
+    Parameters
+    ----------
+    checkpoint : Optional[str], (default=None)
+        JSON lines file to save names of parsed pages and to continue
+        an interrupted parsing from.
+    """
 
-    def __init__(self):
+    def __init__(self, checkpoint: Optional[str] = None):
         self.url = "https://edadeal.ru/moskva/retailers/magnit-univer?page={}"
         self.driver = webdriver.Chrome()
         self.max_pages = 30
+        self.checkpoint = Checkpoint(checkpoint)
 
     def basic_auth(self) -> None:
         """Prepare the page for parsing."""
@@ -25,17 +39,27 @@ class Magnit:
     def parse(self) -> List[str]:
         """Parse all product in `https://edadeal.ru`."""
 
-        self.basic_auth()
-
-        names = []
+        names: List[str] = []
+        is_ready = False
         for page in range(self.max_pages):
-            self.driver.get(self.url.format(page))
-            sleep(2)
-            products = self.driver.find_elements_by_class_name("b-offer__description")
+            if str(page) in self.checkpoint:
+                products = self.checkpoint[str(page)]
+            else:
+                if not is_ready:
+                    self.basic_auth()
+                    is_ready = True
+                self.driver.get(self.url.format(page))
+                sleep(2)
+                products = [
+                    name.text
+                    for name in self.driver.find_elements_by_class_name(
+                        "b-offer__description"
+                    )
+                ]
+                self.checkpoint.save(str(page), products)
             if len(products) == 0:
                 print(f"End on page = {page}.")
                 break
-            for name in products:
-                names.append(name.text)
+            names.extend(products)
 
         return names
@@ -1,20 +1,68 @@
 """Parse info about Perecrestok supremarket: `https://www.perekrestok.ru`."""
 from time import sleep
-from typing import Dict, Optional, NamedTuple, Set, NoReturn
-import requests as req
-from selenium import webdriver  # type: ignore
-from bs4 import BeautifulSoup  # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, NamedTuple, Set, NoReturn
+from bs4 import BeautifulSoup, SoupStrainer  # type: ignore
 import pandas as pd  # type: ignore
 
+try:
+    from receipt_parser.parsers.crawler import Checkpoint, Crawler  # type: ignore
+except ImportError:
+    from crawler import Checkpoint, Crawler  # type: ignore
+
+BASE_URL = "https://www.perekrestok.ru"
+TITLE_CLASS = "js-product__title xf-product-card__title"
+TABLE_CLASS = "xf-product-info__table xf-product-table"
+
+PRODUCT_CLASS = "js-catalog-product _additionals xf-catalog__item"
+LINK_CLASS = "xf-product-picture__link js-product__image"
+
+# Only the title and the table of a product page are built into a tree:
+GOOD_STRAINER = SoupStrainer(class_=[TITLE_CLASS, TABLE_CLASS])
+CATEGORY_STRAINER = SoupStrainer(class_=PRODUCT_CLASS)
+
 Category = NamedTuple("Category", [("name", str), ("url", str)])
 
 
 class Perecrestok:
-    """Allow to parse all data about products from the Perecrestok."""
-
-    def __init__(self):
-        self.main_url = "https://www.perekrestok.ru"
-        self.url_catalog = "https://www.perekrestok.ru/catalog"
+    """
+    Allow to parse all data about products from the Perecrestok.
+    Pages of products are fetched concurrently over one pooled session.
+
+    Parameters
+    ----------
+    base_url : str, (default=BASE_URL)
+        Url of the site, e.g. of a `fixtures.FixtureServer`.
+    workers : int, (default=16)
+        Number of product pages parsed at a time.
+    per_host : int, (default=8)
+        Maximum number of simultaneous requests to the site.
+    use_browser : bool, (default=True)
+        Scroll pages of categories in Chrome to load all products.
+        Otherwise pages are fetched as is, without selenium.
+        Scrolled pages are cached by the crawler, an offline
+        crawler doesn't start the browser.
+    crawler : Optional[Crawler], (default=None)
+        Crawler to fetch pages instead of a new one,
+        e.g. with a cache of pages or an offline one.
+    checkpoint : Optional[str], (default=None)
+        JSON lines file to save parsed categories and to continue
+        an interrupted parsing from.
+    """
+
+    # pylint: disable=bad-continuation,too-many-arguments
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        workers: int = 16,
+        per_host: int = 8,
+        use_browser: bool = True,
+        crawler: Optional[Crawler] = None,
+        checkpoint: Optional[str] = None,
+    ):
+        self.main_url = base_url.rstrip("/")
+        self.url_catalog = self.main_url + "/catalog"
         self.columns = [
             "Название",
             "Категория",
@@ -23,12 +71,19 @@ class Perecrestok:
             "Вес",
             "Жирность",
         ]
+        self.workers = workers
+        self.use_browser = use_browser
+        self.crawler = crawler or Crawler(per_host=per_host)
+        self.checkpoint = Checkpoint(checkpoint)
         self.result = pd.DataFrame(columns=self.columns)
 
     @staticmethod
     def __get_html(url: str) -> str:
         """Scroll down a HTML page and return the HTML-code."""
 
+        # pylint: disable=import-outside-toplevel,import-error
+        from selenium import webdriver  # type: ignore
+
         driver = webdriver.Chrome()
         driver.get(url)
         for i in range(0, 50000, 1080):
@@ -38,55 +93,61 @@ class Perecrestok:
         driver.close()
         return page
 
-    @staticmethod
-    def __get_product_name(soup: BeautifulSoup) -> Optional[str]:
-        """Return the porduct name."""
-
-        name = soup.find(class_="js-product__title xf-product-card__title")
-        if name:
-            name = name.text.split("\n")[0]
-        return name
-
     @staticmethod
     def __raise_error(function_name: str) -> NoReturn:
         """Raise error if status code not equal 200."""
 
         raise ValueError(f"Проблема с подключением к сети в функции {function_name}.")
 
-    def get_catalog(self) -> Set[Category]:
-        """Return set of namedtuples about all categories in the catalog."""
+    def __fetch(self, url: str, function_name: str) -> str:
+        """Return the HTML-code of the page."""
 
-        result: Set[Category] = set()
-        resp = req.get(self.url_catalog)
+        resp = self.crawler.get(url)
         if resp.status_code != 200:
-            self.__raise_error(self.get_catalog.__name__)
-        soup = BeautifulSoup(resp.text, "lxml")
+            self.__raise_error(function_name)
+        return resp.text
+
+    def parse_catalog(self, html: str) -> Set[Category]:
+        """Find all categories on the page of the catalog."""
+
+        result: Set[Category] = set()
+        soup = BeautifulSoup(html, "lxml")
         for cat in soup.find_all(class_="xf-catalog-categories__item"):
             href = cat.find(class_="xf-catalog-categories__link").get("href")
             name = cat.text.strip()
             result.add(Category(name, self.main_url + href))
-
         return result
 
-    def __parse_good(self, url: str) -> Dict[str, Optional[str]]:
-        """Parse information about the product."""
+    def get_catalog(self) -> Set[Category]:
+        """Return set of namedtuples about all categories in the catalog."""
 
-        product: Dict[str, Optional[str]] = {}
-        _ = [product.setdefault(key, None) for key in self.columns]
-        resp = req.get(url)
-        if resp.status_code != 200:
-            self.__raise_error(self.__parse_good.__name__)
-        soup = BeautifulSoup(resp.text, "lxml")
-        product["Название"] = self.__get_product_name(soup)
-        table = soup.find(
-            "table", attrs={"class": "xf-product-info__table xf-product-table"}
-        )
+        html = self.__fetch(self.url_catalog, self.get_catalog.__name__)
+        return self.parse_catalog(html)
+
+    def parse_category_page(self, html: str) -> List[str]:
+        """Find urls of all products on the page of a category."""
+
+        soup = BeautifulSoup(html, "lxml", parse_only=CATEGORY_STRAINER)
+        urls = []
+        for good in soup.find_all(class_=PRODUCT_CLASS):
+            link = good.find(class_=LINK_CLASS)
+            if link is not None:
+                urls.append(f"{self.main_url}{link['href']}")
+        return urls
+
+    def parse_good(self, html: str) -> Dict[str, Optional[str]]:
+        """Parse information about the product from its page."""
+
+        product: Dict[str, Optional[str]] = dict.fromkeys(self.columns)
+        soup = BeautifulSoup(html, "lxml", parse_only=GOOD_STRAINER)
+        name = soup.find(class_=TITLE_CLASS)
+        if name:
+            product["Название"] = name.text.split("\n")[0]
+        table = soup.find("table", attrs={"class": TABLE_CLASS})
         if table:
-            rows = table.find_all("tr")
-            for row in rows:
-                key = row.find_all(class_="xf-product-table__col-header")[
-                    0
-                ].text.strip()
+            for row in table.find_all("tr"):
+                header = row.find_all(class_="xf-product-table__col-header")[0]
+                key = header.text.strip()
                 value = row.find_all("td")[0].text.strip()
                 if key == "Объём":
                     key = "Вес"
@@ -94,38 +155,50 @@ class Perecrestok:
                     product[key] = value
         return product
 
-    def __parse_category(self, category: Category) -> pd.DataFrame:
+    def __parse_good(self, url: str) -> Dict[str, Optional[str]]:
+        """Parse information about the product."""
+
+        return self.parse_good(self.__fetch(url, self.__parse_good.__name__))
+
+    def __parse_category(
+        self, category: Category, executor: ThreadPoolExecutor
+    ) -> List[Dict[str, Optional[str]]]:
         """Parse all products in the categoty."""
 
+        if category.url in self.checkpoint:
+            goods: List[Dict[str, Optional[str]]] = self.checkpoint[category.url]
+            return goods
         print(f"Start parsing {category.name}.")
-        page = self.__get_html(category.url)
-        soup = BeautifulSoup(page, "lxml")
-        goods = soup.find_all(class_="js-catalog-product _additionals xf-catalog__item")
-        for good in goods:
-            url = good.find(class_="xf-product-picture__link js-product__image").get(
-                "href"
-            )
-            url = self.main_url + url
-            product = self.__parse_good(url)
+        if self.use_browser and not self.crawler.offline:
+            page = self.__get_html(category.url)
+            self.crawler.store(category.url, page)
+        else:
+            page = self.__fetch(category.url, self.__parse_category.__name__)
+        goods = list(executor.map(self.__parse_good, self.parse_category_page(page)))
+        for product in goods:
             product["Категория"] = category.name
-            self.result = pd.concat(
-                [self.result, pd.DataFrame.from_dict(product, orient="index").T]
-            )
-
-        self.result = self.result.dropna(subset=["Название"]).drop_duplicates(
-            subset=["Название"]
-        )
-        return self.result
+        return self.checkpoint.save(category.url, goods)
 
     def parse(self) -> pd.DataFrame:
         """Parse all products descriptions from `https://www.perekrestok.ru`."""
 
-        for category in self.get_catalog():
-            self.__parse_category(category)
+        goods: List[Dict[str, Optional[str]]] = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for category in self.get_catalog():
+                goods.extend(self.__parse_category(category, executor))
+
+        self.result = (
+            pd.DataFrame(goods, columns=self.columns)
+            .dropna(subset=["Название"])
+            .drop_duplicates(subset=["Название"])
+        )
         return self.result
 
 
 if __name__ == "__main__":
-    parser = Perecrestok()
+    parser = Perecrestok(
+        crawler=Crawler(cache_dir="perecrestok_cache"),
+        checkpoint="perecrestok_checkpoint.jsonl",
+    )
     data = parser.parse()
     data.to_csv("perecrestok_goods.csv")
@@ -1,10 +1,18 @@
 """Parse info about Peterochka supremarket: `http://pyaterochkaakcii.ru/`."""
-import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, NoReturn
-import requests as req
 from bs4 import BeautifulSoup  # type: ignore
 import pandas as pd  # type: ignore
 
+try:
+    from receipt_parser.parsers.crawler import Checkpoint, Crawler  # type: ignore
+    from receipt_parser.parsers.titles import extract_titles  # type: ignore
+except ImportError:
+    from crawler import Checkpoint, Crawler  # type: ignore
+    from titles import extract_titles  # type: ignore
+
+BASE_URL = "http://pyaterochkaakcii.ru"
+
 
 class ParseProductName:
     """Find brand, product and weight if products desription."""
@@ -12,50 +20,55 @@ class ParseProductName:
     def __init__(self, products: pd.DataFrame):
         self.products = products.dropna().drop_duplicates()
 
-    @staticmethod
-    def find_brand(name: str) -> Optional[str]:
-        """Find brand in product name."""
-
-        pattern = r'"(.*)"'
-        brand = re.findall(pattern, name)
-        return brand[0] if brand else None
-
     @staticmethod
     def remove_brand(name: str, brand: str) -> str:
         """Remove brand from product name."""
 
         return name.replace(f'"{brand}"', "")
 
-    @staticmethod
-    def find_weight_or_volume(name: str) -> Optional[str]:
-        """Find weight or volume in product name."""
-
-        pattern = r"\d+((\.|\,|x|X|х|Х)?)\d* ?([а-я]|[А-Я])*$"
-        result = re.search(pattern, name)
-        return result.group(0) if result else None
-
-    @staticmethod
-    def find_product(name: str) -> str:
-        """Find main product."""
-
-        return name[: name.find(' "')]
-
     def run_parse(self) -> pd.DataFrame:
-        """Find brand, product and weight of goods."""
-
-        self.products["Бренд"] = self.products["Название"].apply(self.find_brand)
-        self.products = self.products.dropna()
-        self.products["Вес"] = self.products["Название"].apply(
-            self.find_weight_or_volume
-        )
-        self.products["Продукт"] = self.products["Название"].apply(self.find_product)
+        """
+        Find brand, product and weight of goods with `titles.extract_titles`,
+        goods without brand are dropped.
+        """
+
+        titles = extract_titles(self.products["Название"], branded_only=True)
+        self.products = pd.concat([self.products, titles], axis=1)
+        self.products = self.products[titles["Бренд"].notna()]
         return self.products
 
 
 class Peterochka:
-    """Allow to parse all data about products from the Peterochka."""
-
-    def __init__(self):
+    """
+    Allow to parse all data about products from the Peterochka.
+    Categories are parsed concurrently over one pooled session,
+    pages of a category are parsed until the first empty one.
+
+    Parameters
+    ----------
+    base_url : str, (default=BASE_URL)
+        Url of the site, e.g. of a `fixtures.FixtureServer`.
+    workers : int, (default=8)
+        Number of categories parsed at a time.
+    per_host : int, (default=4)
+        Maximum number of simultaneous requests to the site.
+    crawler : Optional[Crawler], (default=None)
+        Crawler to fetch pages instead of a new one,
+        e.g. with a cache of pages or an offline one.
+    checkpoint : Optional[str], (default=None)
+        JSON lines file to save parsed categories and to continue
+        an interrupted parsing from.
+    """
+
+    # pylint: disable=bad-continuation
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        workers: int = 8,
+        per_host: int = 4,
+        crawler: Optional[Crawler] = None,
+        checkpoint: Optional[str] = None,
+    ):
         self.katalog = {
             "bakaleya": "Соусы, орехи, консервы.",
             "bytovaya-himiya": "Бытовая химия.",
@@ -73,8 +86,11 @@ class Peterochka:
             "myaso-i-ptica": "Птица, мясо, деликатесы.",
             "kosmetika-i-lichnaya-gigiena": "Красота, гигиена, бытовая химия.",
         }
-        self.url = "http://pyaterochkaakcii.ru/katalog/{category}?page={page}"
+        self.url = base_url.rstrip("/") + "/katalog/{category}?page={page}"
         self.pages = 20
+        self.workers = workers
+        self.crawler = crawler or Crawler(per_host=per_host)
+        self.checkpoint = Checkpoint(checkpoint)
 
     @staticmethod
     def __raise_error(function_name: str) -> NoReturn:
@@ -85,30 +101,40 @@ class Peterochka:
     def parse_category(self, category: tuple) -> List[str]:
         """Parse all products in the categoty."""
 
+        if category[0] in self.checkpoint:
+            goods: List[str] = self.checkpoint[category[0]]
+            return goods
         goods = []
         for page in range(self.pages):
-            resp = req.get(self.url.format(category=category[0], page=page))
+            resp = self.crawler.get(self.url.format(category=category[0], page=page))
             if resp.status_code != 200:
                 self.__raise_error(self.parse_category.__name__)
-            soup = BeautifulSoup(resp.text, "lxml")
-            names = soup.find_all(class_="name")
+            names = self.parse_page(resp.text)
             if not names:  # it was the last page
                 break
-            for name in names:
-                goods.append(name.text)
-        return goods
+            goods.extend(names)
+        print(f"Parsed {category[1]}: {len(goods)} goods")
+        return self.checkpoint.save(category[0], goods)
+
+    @staticmethod
+    def parse_page(html: str) -> List[str]:
+        """Find names of products on a page of a category."""
+
+        soup = BeautifulSoup(html, "lxml")
+        return [name.text for name in soup.find_all(class_="name")]
 
     def _parse_all(self) -> pd.DataFrame:
         """Parse all product in `http://pyaterochkaakcii.ru/`."""
 
-        result = pd.DataFrame(columns=["Название", "Категория"])
-        for category in self.katalog.items():
-            print(f"Start parsing {category[1]}")
-            goods = self.parse_category(category)
-            tmp = pd.DataFrame(goods, columns=["Название"])
-            tmp["Категория"] = category[1]
-            result = pd.concat([result, tmp])
-        return result
+        categories = list(self.katalog.items())
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            goods = executor.map(self.parse_category, categories)
+            records = [
+                (name, category[1])
+                for category, names in zip(categories, goods)
+                for name in names
+            ]
+        return pd.DataFrame(records, columns=["Название", "Категория"])
 
     def parse(self) -> pd.DataFrame:
         """
@@ -123,6 +149,9 @@ class Peterochka:
 
 
 if __name__ == "__main__":
-    parser = Peterochka()
+    parser = Peterochka(
+        crawler=Crawler(cache_dir="peterochka_cache"),
+        checkpoint="peterochka_checkpoint.jsonl",
+    )
     data = parser.parse()
     data.to_csv("peterochka_goods.csv")
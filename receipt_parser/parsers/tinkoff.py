@@ -1,31 +1,51 @@
-"""Use Tinkoff(`https://receiptnlp.tinkoff.ru/`) to parse product goods."""
+"""
+Use Tinkoff(`https://receiptnlp.tinkoff.ru/`) to parse product goods.
+Any other labelling service with a JSON API can be used with `--url`.
+"""
 import sys
+import glob
+import math
+import argparse
 from time import sleep
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence
 from multiprocessing import Pool
 import pandas as pd  # type: ignore
-from selenium import webdriver  # type: ignore
-from selenium.webdriver.common.keys import Keys  # type: ignore
 
-# pylint: disable=unbalanced-tuple-unpacking
+try:
+    from receipt_parser.parsers.labelling import (  # type: ignore
+        HttpLabeller,
+        LabellingClient,
+    )
+except ImportError:
+    from labelling import HttpLabeller, LabellingClient  # type: ignore
 
+# pylint: disable=import-outside-toplevel,import-error
 
-class Tinkoff:
-    """Use Tinkoff server to parse product goods. Use Chrome browser."""
+
+class Tinkoff(LabellingClient):
+    """
+    Use Tinkoff server to parse product goods. Use Chrome browser,
+    so descriptions are labelled one by one.
+    """
 
     def __init__(self):
+        super().__init__(batch_size=1)
         self.url = "https://receiptnlp.tinkoff.ru/"
         self.driver = None
 
     def get_session(self) -> None:
         """Open browser."""
 
+        from selenium import webdriver  # type: ignore
+
         self.driver = webdriver.Chrome()
         self.driver.get(self.url)
 
     def fil_fields(self, name: str) -> None:
         """Delete last text in the field and add new one."""
 
+        from selenium.webdriver.common.keys import Keys  # type: ignore
+
         window = self.driver.find_element_by_class_name("_3gY2s")
         window.send_keys(Keys.CONTROL + "a")
         window.send_keys(Keys.DELETE)
@@ -43,37 +63,60 @@ class Tinkoff:
             result[row.split()[0]] = " ".join(row.split()[1:])
         return result
 
-    def parse_data(self, products: List[str]) -> List[Dict[str, str]]:
-        """Start parsing data."""
-
-        self.get_session()
+    def label(self, names: List[str]) -> List[Dict[str, str]]:
+        if self.driver is None:
+            self.get_session()
         result = []
-        for name in products:
+        for name in names:
             self.fil_fields(name)
             result.append(self.parse_table())
-        self.driver.close()
         return result
 
+    def parse_data(
+        self,
+        products: List[str],
+        checkpoint: Optional[str] = None,
+        resume: Sequence[str] = (),
+    ) -> List[Dict[str, str]]:
+        """
+        Start parsing data. Parsed products are saved to the `checkpoint`
+        JSON lines file, products found in it or in `resume` checkpoints
+        are not parsed again.
+        """
+
+        try:
+            return self.label_all(products, checkpoint, resume)
+        finally:
+            if self.driver is not None:
+                self.driver.close()
+                self.driver = None
+
 
 def get_batches(products: List[str], processes_count: int) -> List[List[str]]:
     """Split List to List[List] for using the multiprocessing."""
 
     result = []
-    bath_size = round(len(products) / processes_count)
+    bath_size = max(math.ceil(len(products) / max(processes_count, 1)), 1)
     for i in range(0, len(products), bath_size):
         result.append(products[i : i + bath_size])
     return result
 
 
-def prepare_data_to_parse(path: str, processes_count: int) -> List[List[str]]:
-    """Read data and prepare it to use in a multiprocessing."""
+def read_names(path: str) -> List[str]:
+    """Read descriptions of goods to label."""
 
     data = pd.read_csv(path)
     target_column = "Название"
     if target_column not in data.columns:
         raise KeyError('Dataset must have a column with name "Название"')
-    data = data["Название"].apply(lambda x: [x]).values.tolist()
-    return get_batches(data, processes_count)
+    names: List[str] = data["Название"].astype(str).tolist()
+    return names
+
+
+def prepare_data_to_parse(path: str, processes_count: int) -> List[List[str]]:
+    """Read data and prepare it to use in a multiprocessing."""
+
+    return get_batches(read_names(path), processes_count)
 
 
 def transform_and_save(data: List[List[Dict[str, str]]], path_to_save: str) -> None:
@@ -84,11 +127,43 @@ def transform_and_save(data: List[List[Dict[str, str]]], path_to_save: str) -> N
     pd.DataFrame.from_dict(data).to_csv(path_to_save, index=False)
 
 
-if __name__ == "__main__":
-    _, PATH_TO_DB, PATH_TO_SAVE, PROCESSES_COUNT = sys.argv
-    prepared_data = prepare_data_to_parse(PATH_TO_DB, int(PROCESSES_COUNT))
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line interface."""
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("path_to_db", help="*.csv file with a column `Название`")
+    parser.add_argument("path_to_save", help="where to save labelled goods")
+    parser.add_argument("processes_count", type=int, help="number of browsers")
+    parser.add_argument("--url", help="url of a labelling service with a JSON API")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--rate", type=float, help="maximum requests per second")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        labeller = HttpLabeller(
+            args.url, args.batch_size, workers=args.processes_count, rate=args.rate
+        )
+        result = labeller.label_all(
+            read_names(args.path_to_db), f"{args.path_to_save}.checkpoint.jsonl"
+        )
+        transform_and_save([result], args.path_to_save)
+        return
+
+    prepared_data = prepare_data_to_parse(args.path_to_db, args.processes_count)
     tinkoff = Tinkoff()
-    pool = Pool(int(PROCESSES_COUNT))
-    res = pool.map(tinkoff.parse_data, prepared_data)
-    transform_and_save(res, PATH_TO_SAVE)
-    pool.close()
+    # Each process saves its progress to its own checkpoint and reuses
+    # products of all checkpoints, so the number of processes can change:
+    resume = sorted(glob.glob(f"{glob.escape(args.path_to_save)}.*.checkpoint.jsonl"))
+    checkpoints = [
+        f"{args.path_to_save}.{i}.checkpoint.jsonl" for i in range(len(prepared_data))
+    ]
+    with Pool(args.processes_count) as pool:
+        res = pool.starmap(
+            tinkoff.parse_data,
+            [(data, path, resume) for data, path in zip(prepared_data, checkpoints)],
+        )
+    transform_and_save(res, args.path_to_save)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,63 @@
+"""
+Extract brand, weight or volume and product from titles of goods
+of any catalogue: `Майонез "Ряба" Провансаль 400г` gives brand `Ряба`,
+weight `400г` and product `Майонез`.
+"""
+import pandas as pd  # type: ignore
+
+# The brand is between the first and the last quote of a line:
+BRAND_PATTERN = r'"(.*)"'
+# A number with units at the end of the title:
+WEIGHT_PATTERN = r"(\d+[.,xXхХ]?\d* ?[а-яА-Я]*)$"
+
+
+def find_product(name: str) -> str:
+    """
+    The title before the first ` "`. A title without ` "` loses its last
+    character, since `str.find` returns -1 for it.
+    """
+
+    return name[: name.find(' "')]
+
+
+def extract_titles(names: pd.Series, branded_only: bool = False) -> pd.DataFrame:
+    """
+    Find brand, weight and product of each title. Each field has its own
+    simple pattern: one regular expression for all of them has to search
+    the weight from every position and is slower than separate passes.
+
+    Parameters
+    ----------
+    names : pd.Series
+        Titles of goods.
+    branded_only : bool, (default=False)
+        Find weight and product only of titles with a brand,
+        e.g. to drop the rest of them afterwards.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns `Бренд`, `Вес` and `Продукт` with the index of `names`,
+        NaN where a title has no brand or weight.
+
+    Examples
+    --------
+    >>> extract_titles(pd.Series(['Майонез "Ряба" Провансаль 400г']))
+          Бренд   Вес  Продукт
+    0      Ряба  400г  Майонез
+    """
+
+    names = names.astype(object)
+    brands = names.str.extract(BRAND_PATTERN, expand=False)
+    if branded_only:
+        names = names[brands.notna()]
+    return pd.DataFrame(
+        {
+            "Бренд": brands,
+            "Вес": names.str.extract(WEIGHT_PATTERN, expand=False),
+            "Продукт": pd.Series(
+                [find_product(name) for name in names], index=names.index, dtype=object
+            ),
+        },
+        index=brands.index,
+    )
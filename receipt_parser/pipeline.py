@@ -0,0 +1,256 @@
+"""
+Parse descriptions in a pipeline: chunks flow through bounded queues
+between normalization, dictionary search, Mystem lemmatization and
+the model, so that all stages work at the same time on different chunks.
+"""
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from typing import Union
+import pandas as pd  # type: ignore
+
+STAGES = ("normalize", "dicts", "mystem", "model")
+_STOP = object()
+
+
+class Pipeline:
+    """
+    Run the stages of `RuleBased.parse` concurrently. Each stage has its
+    own pool of threads and reads chunks from a bounded queue: when the
+    queue is full, the previous stage waits (backpressure), so memory
+    doesn't grow if one stage is slower than the others. Results are
+    returned in the order of the input chunks.
+
+    Mystem communicates with a subprocess and releases the GIL while
+    waiting for it, so regular expressions of other stages run meanwhile.
+    A `Finder` has only one Mystem process, so more than one thread
+    for the `mystem` stage doesn't make sense. Known descriptions
+    of `RuleBased` are not used in this mode.
+
+    Parameters
+    ----------
+    rules : RuleBased
+        Loaded parser.
+    chunk_size : int, (default=1000)
+        Number of descriptions in a chunk.
+    queue_size : int, (default=4)
+        Maximum number of chunks waiting before each stage.
+    workers : Optional[Dict[str, int]], (default=None)
+        Number of threads of stages by their names from `STAGES`,
+        one thread for each stage by default.
+
+    Attributes
+    ----------
+    max_depth : Dict[str, int]
+        Maximum number of chunks waited in each queue during the last run.
+
+    Examples
+    --------
+    >>> pipeline = Pipeline(RuleBased(), workers={"dicts": 2, "model": 2})
+    >>> pipeline.parse(df['name'], verbose=1)
+    >>> pipeline.max_depth
+    """
+
+    # pylint: disable=bad-continuation
+    def __init__(
+        self,
+        rules,
+        chunk_size: int = 1000,
+        queue_size: int = 4,
+        workers: Optional[Dict[str, int]] = None,
+    ):
+        unknown = set(workers or {}) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Неизвестные стадии: {', '.join(sorted(unknown))}.")
+        if chunk_size < 1 or queue_size < 1:
+            raise ValueError("Размер чанка и очереди должен быть положительным.")
+
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.workers = {name: 1 for name in STAGES}
+        self.workers.update(workers or {})
+        self.rules = rules
+        self.queues: Dict[str, queue.Queue] = {}
+        self.max_depth: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def depth(self) -> Dict[str, int]:
+        """Return the current number of chunks waiting in each queue."""
+
+        return {name: inbox.qsize() for name, inbox in self.queues.items()}
+
+    def __put(self, name: str, item: Any) -> None:
+        """Put an item into the queue and remember its maximum depth."""
+
+        self.queues[name].put(item)
+        depth = self.queues[name].qsize()
+        with self._lock:
+            if depth > self.max_depth[name]:
+                self.max_depth[name] = depth
+
+    # pylint: disable=too-many-arguments
+    def __work(
+        self,
+        func: Callable[[Any], pd.DataFrame],
+        inbox: str,
+        outbox: str,
+        remaining: Dict[str, int],
+        errors: List[BaseException],
+    ) -> None:
+        """
+        Process chunks of a stage until the stop marker. After an error
+        chunks are skipped, so that all threads finish.
+        """
+
+        while True:
+            item = self.queues[inbox].get()
+            if item is _STOP:
+                break
+            number, chunk = item
+            if errors:
+                continue
+            try:
+                result = func(chunk)
+            except BaseException as error:  # pylint: disable=broad-except
+                errors.append(error)
+                continue
+            self.__put(outbox, (number, result))
+
+        with self._lock:
+            remaining[inbox] -= 1
+            is_last = remaining[inbox] == 0
+        if is_last:
+            for _ in range(self.workers.get(outbox, 1)):
+                self.queues[outbox].put(_STOP)
+
+    def __feed(self, chunks: Iterable[pd.Series], errors: List[BaseException]) -> None:
+        """Put numbered input chunks into the first queue."""
+
+        first = STAGES[0]
+        try:
+            for number, chunk in enumerate(chunks):
+                if errors:
+                    break
+                self.__put(first, (number, chunk))
+        except BaseException as error:  # pylint: disable=broad-except
+            errors.append(error)
+        for _ in range(self.workers[first]):
+            self.queues[first].put(_STOP)
+
+    # pylint: disable=too-many-locals
+    def run(
+        self, chunks: Iterable[pd.Series], verbose: int = 0
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Parse chunks of descriptions and yield results in the input order
+        as soon as they are ready. Chunks are read from `chunks` lazily,
+        so it can be a generator over a large file.
+
+        Parameters
+        ----------
+        chunks : Iterable[pd.Series]
+            Chunks of descriptions.
+        verbose: int (default=0)
+            Set verbose to any positive number to print queue depths.
+
+        Yields
+        ------
+        pd.DataFrame
+            Recognized product names, brands and product categories.
+        """
+
+        # All chunks of a run use the same lexicons even if they are reloaded:
+        lexicons = self.rules.lexicons
+        stages: List[Tuple[str, Callable[[Any], pd.DataFrame]]] = [
+            ("normalize", lexicons.norm.normalize),
+            ("dicts", lexicons.find.find_in_dicts),
+            ("mystem", lexicons.find.find_with_mystem),
+            ("model", lexicons.find.find_with_model),
+        ]
+        names = list(STAGES)
+        self.queues = {
+            name: queue.Queue(maxsize=self.queue_size) for name in names + ["output"]
+        }
+        self.max_depth = {name: 0 for name in self.queues}
+        remaining = {name: self.workers[name] for name in names}
+        errors: List[BaseException] = []
+
+        threads = [threading.Thread(target=self.__feed, args=(chunks, errors))]
+        for i, (name, func) in enumerate(stages):
+            outbox = names[i + 1] if i + 1 < len(names) else "output"
+            threads += [
+                threading.Thread(
+                    target=self.__work, args=(func, name, outbox, remaining, errors)
+                )
+                for _ in range(self.workers[name])
+            ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        pending: Dict[int, pd.DataFrame] = {}
+        expected = 0
+        item: Any = None
+        try:
+            while True:
+                item = self.queues["output"].get()
+                if item is _STOP:
+                    break
+                number, result = item
+                pending[number] = result
+                if verbose:
+                    print(f"Chunk {number} is ready, queue depth: {self.depth()}")
+                while expected in pending and not errors:
+                    yield pending.pop(expected).drop("name_norm", axis=1)
+                    expected += 1
+        finally:
+            if item is not _STOP:
+                # The consumer stopped early: let the threads skip the rest:
+                errors.append(GeneratorExit())
+                while item is not _STOP:
+                    item = self.queues["output"].get()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def parse(
+        self, data: Union[pd.DataFrame, pd.Series], verbose: int = 0
+    ) -> pd.DataFrame:
+        """
+        Split descriptions into chunks and parse them in the pipeline.
+
+        Parameters
+        ----------
+        data : Union[pd.DataFrame, pd.Series]
+            Text column with a description of the products to parse.
+        verbose: int (default=0)
+            Set verbose to any positive number to print queue depths.
+
+        Returns
+        -------
+        pd.DataFrame
+            Recognized product names, brands and product categories.
+        """
+
+        if isinstance(data, pd.DataFrame):
+            if "name" not in data.columns:
+                raise ValueError(
+                    "Столбец с описанием товара должен иметь название `name`."
+                )
+            data = data["name"]
+        data = pd.Series(data, name="name")
+
+        chunks = (
+            data.iloc[start : start + self.chunk_size]
+            for start in range(0, len(data), self.chunk_size)
+        )
+        results = list(self.run(chunks, verbose))
+        if verbose:
+            print(f"Maximum queue depth: {self.max_depth}")
+        if not results:
+            return pd.DataFrame(
+                columns=["name", "product_norm", "brand_norm", "cat_norm"]
+            )
+        return pd.concat(results)
@@ -2,77 +2,59 @@
 Provide various types of technologies for recognition
 and normalization product descriptions.
 """
-import os
-from typing import Union, Optional, Dict
-import wget  # type: ignore
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Union, Optional, Dict, Iterable, NamedTuple
 import pandas as pd  # type: ignore
 
 try:
-    from receipt_parser.finder import Finder  # type: ignore
-    from receipt_parser.normalizer import Normalizer  # type: ignore
+    from receipt_parser.finder import Finder, UNCERTAIN  # type: ignore
+    from receipt_parser.normalizer import Normalizer, load_tables  # type: ignore
+    from receipt_parser.known import KnownDescriptions  # type: ignore
+    from receipt_parser.resources import Resources, sha256  # type: ignore
+    from receipt_parser.arrow_io import (  # type: ignore
+        is_arrow,
+        parse_arrow,
+        RESULT_COLUMNS,
+    )
 except ImportError:
-    from finder import Finder  # type: ignore
-    from normalizer import Normalizer  # type: ignore
-
-
-class DownloadData:
-    """Download some data that i can't add to PyPi."""
-
-    def __init__(self):
-        # pylint: disable=line-too-long
-        self.base_url = "https://raw.githubusercontent.com/slgero/receipt_parser/master/receipt_parser"
-        self.files: Dict[str, str] = {
-            "cleaned/all_clean.csv": f"{self.base_url}/data/cleaned/all_clean.csv",
-            "cleaned/brands_en.csv": f"{self.base_url}/data/cleaned/brands_en.csv",
-            "cleaned/brands_ru.csv": f"{self.base_url}/data/cleaned/brands_ru.csv",
-            "cleaned/products.csv": f"{self.base_url}/data/cleaned/products.csv",
-            "blacklist.csv": f"{self.base_url}/data/blacklist.csv",
-            "cat_bpe_model.yttm": f"{self.base_url}/models/cat_bpe_model.yttm",
-            "cat_model.pth": f"{self.base_url}/models/cat_model.pth",
-        }
-        self.home_folder: str = os.path.join(os.getcwd(), "data")
-
-    @staticmethod
-    def _is_folder_exists() -> bool:
-        """Check if folder `data` exists."""
+    from finder import Finder, UNCERTAIN  # type: ignore
+    from normalizer import Normalizer, load_tables  # type: ignore
+    from known import KnownDescriptions  # type: ignore
+    from resources import Resources, sha256  # type: ignore
+    from arrow_io import is_arrow, parse_arrow, RESULT_COLUMNS  # type: ignore
 
-        pwd: str = os.getcwd()
-        data_folder: str = os.path.join(pwd, "data")
-        return os.path.isdir(data_folder)
-
-    @staticmethod
-    def _make_dirs() -> None:
-        """Make 3 dirs: `data/`, `models` and `data/cleaned`."""
+Lexicons = NamedTuple(
+    "Lexicons", [("norm", Normalizer), ("find", Finder), ("version", str)]
+)
 
-        os.makedirs("data")
-        os.makedirs(os.path.join("data", "cleaned"))
-        os.makedirs(os.path.join("data", "models"))
 
-    def download_files(self) -> None:
-        """Download files from my github account."""
-
-        for name, url in self.files.items():
-            print(f"Download {name.split('/')[-1]}")
-            wget.download(url, os.path.join("data", name))
-
-    def get_pathes(self) -> Dict[str, str]:
-        """Return new pathes to files."""
+def lexicon_version(
+    pathes: Dict[str, str], tables: Dict[str, Dict[str, str]], options: Dict[str, Any]
+) -> str:
+    """
+    Identify the lexicons by hashes of the files, the tables of
+    `dicts.py` and the options of `Finder`. Results of parsing can be
+    cached by this version and invalidated when it changes.
+    """
 
-        pathes: Dict[str, str] = {}
+    hasher = hashlib.sha256()
+    for name in sorted(pathes):
+        hasher.update(f"{name}:{sha256(pathes[name])};".encode())
+    hasher.update(json.dumps(tables, sort_keys=True, ensure_ascii=False).encode())
+    hasher.update(json.dumps(options, sort_keys=True).encode())
+    return hasher.hexdigest()[:16]
 
-        for path in self.files:
-            name = path.split("/")[-1].split(".")[0]
-            pathes[name] = os.path.join(self.home_folder, path)
-        return pathes
 
-    def download(self) -> Dict[str, str]:
-        """Download files and return new pathes."""
+def model_version(version: str, temperature: float) -> str:
+    """
+    Identify the lexicons together with the temperature of the model,
+    which `PredictCategory.calibrate` changes after loading.
+    """
 
-        if not self._is_folder_exists():
-            print("It's need to download some data...")
-            self._make_dirs()
-            self.download_files()
-        return self.get_pathes()
+    return hashlib.sha256(f"{version}:{temperature!r}".encode()).hexdigest()[:16]
 
 
 # pylint: disable=too-few-public-methods
@@ -85,10 +67,39 @@ class RuleBased:
     Parameters
     ----------
     pathes: Optional[Dict[str, str]] (default=None)
-        Dictionary with paths to *.csv files.
+        Dictionary with paths to *.csv files. Missing files are
+        searched in the package data and in the per-user cache.
+    candidates_policy: str, (default="pairs")
+        Which word combinations `Finder` looks up in the datasets:
+        `pairs` - all pairs of words, `adjacent` - only neighbouring words.
+    fuzzy_distance: int, (default=0)
+        Maximum edit distance of fuzzy search of products and brands
+        before Mystem, 0 disables it. See `receipt_parser.fuzzy`.
+    expand_prefixes: bool, (default=False)
+        Expand truncated words to the only product name which starts
+        with them during normalization. See `receipt_parser.trie`.
+    min_confidence: Optional[float], (default=None)
+        Minimum calibrated score of a category predicted by the model,
+        less confident descriptions get the category `"uncertain"`,
+        e.g. to send them to a manual review.
+    temperature: float, (default=1.0)
+        Temperature of scores of the model,
+        see `receipt_parser.cat_model.PredictCategory.calibrate`.
+    category_cache_size: int, (default=65536)
+        Number of descriptions whose predictions of the model are cached,
+        0 disables the cache. See `receipt_parser.finder.Finder`.
+    known: Optional[KnownDescriptions], (default=None)
+        Table of already labelled descriptions. Descriptions found
+        in it are returned as is without normalization and search.
+    download: bool, (default=False)
+        Download files missing in the package data and in the cache.
+        See `receipt_parser.resources.Resources`.
 
     Attributes
     ----------
+    lexicons: Lexicons
+        Loaded `Normalizer`, `Finder` and the version of their lexicons.
+        Replaced as a whole by `reload`.
     norm: Normalizer
         Normalize product description: expand abbreviations,
         delete garbage words and characters for further recognition,
@@ -96,19 +107,162 @@ class RuleBased:
     find : Finder
         Search and recognize the name, category and brand of a product
         from its description.
+    version : str
+        Version of the lexicons and the temperature of the model,
+        see `lexicon_version` and `model_version`.
+    known : Optional[KnownDescriptions]
+        Table of already labelled descriptions.
 
     Examples
     --------
-    >>> rules = RuleBased()
+    >>> rules = RuleBased(known=KnownDescriptions.load('known.pkl'))
     >>> rules.parse(df['name'])
     """
 
-    def __init__(self, pathes: Optional[Dict[str, str]] = None):
-        download_pathes: Dict[str, str] = DownloadData().download()
-        pathes = pathes or download_pathes
+    # pylint: disable=bad-continuation,too-many-arguments
+    def __init__(
+        self,
+        pathes: Optional[Dict[str, str]] = None,
+        candidates_policy: str = "pairs",
+        known: Optional[KnownDescriptions] = None,
+        download: bool = False,
+        fuzzy_distance: int = 0,
+        expand_prefixes: bool = False,
+        min_confidence: Optional[float] = None,
+        temperature: float = 1.0,
+        category_cache_size: int = 65536,
+    ):
+        self.pathes = pathes
+        self.expand_prefixes = expand_prefixes
+        self.finder_options: Dict[str, Any] = {
+            "candidates_policy": candidates_policy,
+            "fuzzy_distance": fuzzy_distance,
+            "min_confidence": min_confidence,
+            "temperature": temperature,
+            "category_cache_size": category_cache_size,
+        }
+        self.download = download
+        self.known = known
+        self._reload_lock = threading.Lock()
+        self.lexicons = self.__load(pathes, load_tables())
+
+    def __load(
+        self,
+        pathes: Optional[Dict[str, str]],
+        tables: Dict[str, Dict[str, str]],
+        use_parallel: Optional[bool] = None,
+    ) -> Lexicons:
+        """Load `Normalizer` and `Finder`."""
+
+        pathes = Resources().resolve(pathes, self.download)
+        version = lexicon_version(pathes, tables, self.__options())
+        return Lexicons(
+            Normalizer(pathes, use_parallel, tables, self.expand_prefixes),
+            Finder(pathes, **self.finder_options),
+            version,
+        )
+
+    def __options(self) -> Dict[str, Any]:
+        """
+        Options which change results of parsing. The temperature of the model
+        is a part of `version`, see `model_version`. The size of the cache
+        of predictions doesn't change results.
+        """
+
+        options = dict(self.finder_options, expand_prefixes=self.expand_prefixes)
+        del options["temperature"], options["category_cache_size"]
+        return options
+
+    @property
+    def norm(self) -> Normalizer:
+        """`Normalizer` of the current lexicons."""
+
+        return self.lexicons.norm
+
+    @property
+    def find(self) -> Finder:
+        """`Finder` of the current lexicons."""
+
+        return self.lexicons.find
+
+    @property
+    def version(self) -> str:
+        """Version of the current lexicons and the temperature of the model."""
+
+        return model_version(self.lexicons.version, self.find.cat_model.temperature)
+
+    def reload(
+        self, pathes: Optional[Dict[str, str]] = None, reload_dicts: bool = True
+    ) -> str:
+        """
+        Load the lexicons again and replace the current ones at once.
+        Parsing continues with the old lexicons while the new ones
+        are loaded, batches which already started finish with them.
+        Nothing is loaded if the version didn't change.
+
+        Parameters
+        ----------
+        pathes: Optional[Dict[str, str]] (default=None)
+            New paths to files, the paths passed to the constructor by default.
+        reload_dicts: bool, (default=True)
+            Read the tables of `dicts.py` again.
+
+        Returns
+        -------
+        str
+            Version of the loaded lexicons.
+        """
 
-        self.norm = Normalizer(pathes)
-        self.find = Finder(pathes)
+        with self._reload_lock:
+            pathes = self.pathes if pathes is None else pathes
+            old = self.lexicons
+            # Keep the temperature of the model if it was calibrated:
+            self.finder_options["temperature"] = old.find.cat_model.temperature
+            tables = load_tables(reload=True) if reload_dicts else old.norm.tables
+            resolved = Resources().resolve(pathes, self.download)
+            if lexicon_version(resolved, tables, self.__options()) != old.version:
+                self.lexicons = self.__load(resolved, tables, old.norm.use_parallel)
+            self.pathes = pathes
+            return self.version
+
+    def reload_in_background(
+        self, pathes: Optional[Dict[str, str]] = None, reload_dicts: bool = True
+    ) -> "Future[str]":
+        """
+        Run `reload` in a separate thread.
+
+        Returns
+        -------
+        Future[str]
+            Version of the loaded lexicons or the error of loading.
+        """
+
+        future: "Future[str]" = Future()
+
+        def run() -> None:
+            try:
+                future.set_result(self.reload(pathes, reload_dicts))
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def add_known(
+        self,
+        names: Iterable[str],
+        products: Iterable[Optional[str]],
+        brands: Iterable[Optional[str]],
+        categories: Iterable[Optional[str]],
+    ) -> int:
+        """
+        Add verified descriptions to the table of known descriptions in bulk.
+        See `receipt_parser.known.KnownDescriptions.add`.
+        """
+
+        if self.known is None:
+            self.known = KnownDescriptions()
+        return self.known.add(names, products, brands, categories)
 
     @staticmethod
     def __transform_data(data: Union[pd.DataFrame, pd.Series, str]) -> pd.Series:
@@ -122,19 +276,26 @@ class RuleBased:
             return data["name"]
         return pd.Series(data, name="name")
 
-    # pylint: disable=bad-continuation
     def parse(
-        self, data: Union[pd.DataFrame, pd.Series, str], verbose: int = 0
+        self,
+        data: Union[pd.DataFrame, pd.Series, str],
+        verbose: int = 0,
+        categorical: bool = False,
     ) -> pd.DataFrame:
         """
         Start the parsing process.
 
         Parameters
         ----------
-        data : Union[pd.DataFrame, pd.Series, str]
+        data : Union[pd.DataFrame, pd.Series, str, pa.Table, pa.Array]
             Text column with a description of the products to parse.
+            Arrow tables and arrays are parsed without converting
+            all descriptions to Python objects, see `arrow_io.parse_arrow`.
         verbose: int (default=0)
             Set verbose to any positive number for verbosity.
+        categorical: bool (default=False)
+            Return `product_norm`, `brand_norm` and `cat_norm`
+            as categorical columns to save memory on large outputs.
 
         Returns
         -------
@@ -142,8 +303,80 @@ class RuleBased:
             Recognized product names, brands and product categories.
         """
 
+        if is_arrow(data):
+            data = parse_arrow(self, data, verbose=verbose).to_pandas()
+            if not categorical:
+                # Missing values are None as in results of pd.Series:
+                results = data[RESULT_COLUMNS].astype(object)
+                data[RESULT_COLUMNS] = results.where(results.notna(), None)
+            return data
+
+        lexicons = self.lexicons
         data = self.__transform_data(data)
-        data = self.norm.normalize(data)
-        data = self.find.find_all(data, verbose)
+        if self.known is None or not len(self.known):
+            data = self.__parse_rules(data, lexicons, verbose)
+        else:
+            data = self.__parse_known(data, lexicons, self.known, verbose)
+
+        if categorical:
+            data = self.__to_categorical(data, lexicons)
+        return data
+
+    def __parse_known(
+        self,
+        data: pd.Series,
+        lexicons: Lexicons,
+        known: KnownDescriptions,
+        verbose: int,
+    ) -> pd.DataFrame:
+        """
+        Take labels of the known descriptions from the table
+        and recognize only the rest of them.
+        """
+
+        index = data.index
+        data = data.reset_index(drop=True)
+        found = known.lookup(data)
+        found.insert(0, "name", data.iloc[found.index])
+        if verbose:
+            print(f"Found in known descriptions: {len(found)}/{len(data)}", end="\n\n")
+
+        rest = data.drop(found.index)
+        if len(rest):
+            found = pd.concat(
+                [found, self.__parse_rules(rest, lexicons, verbose)]
+            ).sort_index()
+        found.index = index
+        return found
+
+    @staticmethod
+    def __parse_rules(
+        data: pd.Series, lexicons: Lexicons, verbose: int
+    ) -> pd.DataFrame:
+        """Recognize descriptions with `Normalizer` and `Finder`."""
+
+        if data.empty:
+            return pd.DataFrame({"name": data}, columns=["name"] + RESULT_COLUMNS)
+        data = lexicons.norm.normalize(data)
+        data = lexicons.find.find_all(data, verbose)
         data = data.drop("name_norm", axis=1)
         return data
+
+    @staticmethod
+    def __to_categorical(data: pd.DataFrame, lexicons: Lexicons) -> pd.DataFrame:
+        """
+        Convert the result columns to categorical. Categories of `cat_norm`
+        always include all categories of the model, so that results of
+        different batches have the same dtype.
+        """
+
+        categories = set(lexicons.find.cat_model.categories)
+        if lexicons.find.min_confidence is not None:
+            categories.add(UNCERTAIN)
+        categories.update(data["cat_norm"].dropna())
+        data["cat_norm"] = pd.Categorical(
+            data["cat_norm"], categories=sorted(categories)
+        )
+        for col in ["product_norm", "brand_norm"]:
+            data[col] = data[col].astype("category")
+        return data
@@ -0,0 +1,199 @@
+"""Find data files and models without depending on the working directory."""
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import wget  # type: ignore
+
+try:
+    from importlib.resources import files  # type: ignore
+except ImportError:  # Python < 3.9
+    files = None  # type: ignore
+
+BASE_URL = (
+    "https://raw.githubusercontent.com/slgero/receipt_parser/master/receipt_parser"
+)
+
+Resource = NamedTuple("Resource", [("path", str), ("sha256", Optional[str])])
+
+# `all_clean.csv` is too large for PyPi and is not shipped with the package,
+# so its hash isn't pinned: the file is only checked for existence.
+MANIFEST: Dict[str, Resource] = {
+    "all_clean": Resource("data/cleaned/all_clean.csv", None),
+    "brands_en": Resource(
+        "data/cleaned/brands_en.csv",
+        "a5ad828340ab71c0dc0f3f6c3a525b89560ec4d52835dede210e8d4637e12867",
+    ),
+    "brands_ru": Resource(
+        "data/cleaned/brands_ru.csv",
+        "03f785a76249d0e004838a74cccb6866b5ecb060711f9321d993b9ae5b11cc77",
+    ),
+    "products": Resource(
+        "data/cleaned/products.csv",
+        "fe886b03a22a5e64683d4ccf61f0a54a6449c87a554fb8b23bc821d12023aff6",
+    ),
+    "blacklist": Resource(
+        "data/blacklist.csv",
+        "d0e34e39686d948c9c8f88587b6786312e2a4348bc1260bb3eb6f9507e5f9b1f",
+    ),
+    "cat_bpe_model": Resource(
+        "models/cat_bpe_model.yttm",
+        "52405da670daf6403342fe88de6687c183aa22aa1d1b423c990998260990bb98",
+    ),
+    "cat_model": Resource(
+        "models/cat_model.pth",
+        "eb00f9855c2183dfe96d545521818fd6a17ce686e29b1bcf55d234f2e396226d",
+    ),
+}
+
+
+def default_cache_dir() -> str:
+    """
+    Return the per-user cache directory: `$RECEIPT_PARSER_CACHE`,
+    `$XDG_CACHE_HOME/receipt_parser` or `~/.cache/receipt_parser`.
+    """
+
+    if os.environ.get("RECEIPT_PARSER_CACHE"):
+        return os.environ["RECEIPT_PARSER_CACHE"]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "receipt_parser")
+
+
+def package_dir() -> str:
+    """Return the directory of the installed package."""
+
+    if files is not None and __package__:
+        return str(files(__package__))
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def sha256(path: str) -> str:
+    """Calculate the SHA-256 hash of the file."""
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class Resources:
+    """
+    Resolve paths to data files and models. Each file is searched
+    in order in:
+    1. Paths passed explicitly by the user (used as is);
+    2. Data of the installed package;
+    3. The per-user cache directory.
+    Files found in the package or in the cache are checked against
+    the manifest of hashes. Nothing is downloaded unless it is requested.
+
+    Parameters
+    ----------
+    cache_dir: Optional[str], (default=None)
+        Directory to keep downloaded files, see `default_cache_dir`.
+    manifest: Optional[Dict[str, Resource]], (default=None)
+        Relative paths and hashes of the files, `MANIFEST` by default.
+    base_url: str, (default=BASE_URL)
+        Where to download missing files from.
+
+    Examples
+    --------
+    >>> pathes = Resources().resolve(download=True)
+    >>> rules = RuleBased(pathes)
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        manifest: Optional[Dict[str, Resource]] = None,
+        base_url: str = BASE_URL,
+    ):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.manifest = manifest or MANIFEST
+        self.base_url = base_url
+
+    def _is_valid(self, name: str, path: str) -> bool:
+        """Check that the file exists and has the expected hash."""
+
+        if not os.path.isfile(path):
+            return False
+        expected = self.manifest[name].sha256
+        return expected is None or sha256(path) == expected
+
+    def find(self, name: str) -> Optional[str]:
+        """Find a valid file in the package data or in the cache."""
+
+        relative = self.manifest[name].path
+        for folder in (package_dir(), self.cache_dir):
+            path = os.path.join(folder, relative)
+            if self._is_valid(name, path):
+                return path
+        return None
+
+    def _download_one(self, name: str) -> str:
+        """Download the file to the cache and check its hash."""
+
+        relative = self.manifest[name].path
+        path = os.path.join(self.cache_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        wget.download(f"{self.base_url}/{relative}", out=tmp_path, bar=None)
+        if not self._is_valid(name, tmp_path):
+            os.remove(tmp_path)
+            raise ValueError(f"Хэш-сумма файла `{relative}` не совпадает с ожидаемой.")
+        os.replace(tmp_path, path)
+        return path
+
+    def download(self, names: Iterable[str], workers: int = 4) -> Dict[str, str]:
+        """Download files to the cache concurrently."""
+
+        names = list(names)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(names, executor.map(self._download_one, names)))
+
+    def resolve(
+        self,
+        pathes: Optional[Dict[str, str]] = None,
+        download: bool = False,
+        names: Optional[Iterable[str]] = None,
+    ) -> Dict[str, str]:
+        """
+        Return paths to all required files.
+
+        Parameters
+        ----------
+        pathes: Optional[Dict[str, str]], (default=None)
+            Explicit paths to files, they have the highest priority.
+        download: bool, (default=False)
+            Download missing files to the cache. Otherwise raise an error.
+        names: Optional[Iterable[str]], (default=None)
+            Names of required files, all files of the manifest by default.
+
+        Returns
+        -------
+        Dict[str, str]
+            Paths to files by their names.
+        """
+
+        result: Dict[str, str] = dict(pathes or {})
+        missing: List[str] = []
+        for name in names or self.manifest:
+            if name in result:
+                continue
+            path = self.find(name)
+            if path is None:
+                missing.append(name)
+            else:
+                result[name] = path
+
+        if missing and download:
+            result.update(self.download(missing))
+        elif missing:
+            raise FileNotFoundError(
+                f"Не найдены файлы: {', '.join(missing)}. "
+                "Передайте пути к ним в `pathes` или скачайте их, "
+                "указав `download=True`."
+            )
+        return result
@@ -0,0 +1,416 @@
+"""
+Run `RuleBased` over large dumps split into shards. Any number of
+worker processes on any number of machines claim shards through lease
+files on shared storage, results are merged in the order of the manifest.
+
+Examples
+--------
+$ python -m receipt_parser.sharding plan work_dir dump_1.csv dump_2.csv
+$ python -m receipt_parser.sharding work work_dir      # on every node
+$ python -m receipt_parser.sharding merge work_dir result.csv
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import socket
+import argparse
+import threading
+import multiprocessing as mp
+from typing import Any, Dict, List, Optional
+import pandas as pd  # type: ignore
+
+try:
+    from receipt_parser.receipt_parser import RuleBased  # type: ignore
+    from receipt_parser.arrow_io import parse_arrow, require_pyarrow, pq
+except ImportError:
+    from receipt_parser import RuleBased  # type: ignore
+    from arrow_io import parse_arrow, require_pyarrow, pq  # type: ignore
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _manifest_path(work_dir: str) -> str:
+    """Return the path to the manifest."""
+
+    return os.path.join(work_dir, MANIFEST_NAME)
+
+
+def _shard_path(work_dir: str, shard: Dict[str, Any], suffix: str) -> str:
+    """Return the path to a file of the shard."""
+
+    return os.path.join(work_dir, "shards", f"{shard['id']:06d}.{suffix}")
+
+
+def _atomic_write(path: str, write) -> None:
+    """Write a file under a temporary name and rename it."""
+
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _dump_json(data: Dict[str, Any], path: str) -> None:
+    """Save data as a JSON file."""
+
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=1)
+
+
+def load_manifest(work_dir: str) -> Dict[str, Any]:
+    """Read the manifest of the working directory."""
+
+    with open(_manifest_path(work_dir), "r", encoding="UTF-8") as file:
+        return json.load(file)
+
+
+# pylint: disable=bad-continuation
+def plan(
+    work_dir: str, sources: List[str], column: str = "name", shard_size: int = 100000
+) -> Dict[str, Any]:
+    """
+    Split input files into shards and write the manifest.
+    *.csv files are split into shard files in `work_dir`,
+    *.parquet files are split by row groups without copying.
+    Shards, results and leases of the previous plan are removed.
+
+    Parameters
+    ----------
+    work_dir : str
+        Directory on storage shared by all workers.
+    sources : List[str]
+        Input *.csv or *.parquet files.
+    column : str, (default="name")
+        Column with descriptions.
+    shard_size : int, (default=100000)
+        Number of rows in a *.csv shard.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The manifest.
+    """
+
+    shards: List[Dict[str, Any]] = []
+    formats = {os.path.splitext(source)[1].lower() for source in sources}
+    if len(formats) != 1 or not formats <= {".csv", ".parquet"}:
+        raise ValueError("Все входные файлы должны быть либо *.csv, либо *.parquet.")
+    output_format = formats.pop()[1:]
+    shutil.rmtree(os.path.join(work_dir, "shards"), ignore_errors=True)
+    os.makedirs(os.path.join(work_dir, "shards"))
+
+    for source in sources:
+        if output_format == "parquet":
+            require_pyarrow()
+            metadata = pq.ParquetFile(source).metadata
+            for row_group in range(metadata.num_row_groups):
+                rows = metadata.row_group(row_group).num_rows
+                shards.append(
+                    {
+                        "id": len(shards),
+                        "source": source,
+                        "row_group": row_group,
+                        "rows": rows,
+                    }
+                )
+            continue
+        for chunk in pd.read_csv(source, usecols=[column], chunksize=shard_size):
+            shard = {"id": len(shards), "source": source, "rows": len(chunk)}
+            shard["input"] = _shard_path(work_dir, shard, "input.csv")
+            chunk.to_csv(shard["input"], index=False)
+            shards.append(shard)
+
+    manifest = {"column": column, "format": output_format, "shards": shards}
+    _atomic_write(_manifest_path(work_dir), lambda path: _dump_json(manifest, path))
+    return manifest
+
+
+class Lease:
+    """
+    Exclusive claim of a shard by a worker. The lease file is created
+    atomically and its modification time is renewed by a background
+    thread. A lease which wasn't renewed for `timeout` seconds belongs
+    to a dead worker and can be taken over: the first worker which
+    creates the takeover file named after the dead owner replaces
+    the lease with its own.
+
+    Parameters
+    ----------
+    path : str
+        Path to the lease file.
+    timeout : float
+        Lease lifetime in seconds without renewal.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __create(self, path: str) -> bool:
+        """Create the file with the owner if it doesn't exist."""
+
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(descriptor, self.owner.encode())
+        os.close(descriptor)
+        return True
+
+    def __read_owner(self) -> Optional[str]:
+        """Return the owner of the lease file, None if it doesn't exist."""
+
+        try:
+            with open(self.path, "r", encoding="UTF-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def __write_owner(self, path: str) -> None:
+        """Write the owner to a new file."""
+
+        with open(path, "w", encoding="UTF-8") as file:
+            file.write(self.owner)
+
+    def acquire(self) -> bool:
+        """Try to claim the shard, taking over a stale lease."""
+
+        if self.__create(self.path):
+            return self.__start()
+        # Read the owner before the modification time, so that a lease
+        # renewed or taken over in between isn't considered stale:
+        owner = self.__read_owner()
+        try:
+            is_stale = time.time() - os.path.getmtime(self.path) > self.timeout
+        except FileNotFoundError:
+            return False
+        if owner is None or not is_stale:
+            return False
+        # Only one worker succeeds in creating the takeover file of the owner:
+        digest = hashlib.sha256(owner.encode()).hexdigest()[:16]
+        if not self.__create(f"{self.path}.{digest}.takeover"):
+            return False
+        _atomic_write(self.path, self.__write_owner)
+        return self.__read_owner() == self.owner and self.__start()
+
+    def __start(self) -> bool:
+        """Start renewal of the lease."""
+
+        self._thread = threading.Thread(target=self.__renew, daemon=True)
+        self._thread.start()
+        return True
+
+    def __renew(self) -> None:
+        """Update the modification time of the lease file."""
+
+        while not self._stop.wait(self.timeout / 3):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def release(self) -> None:
+        """Stop renewal and remove the lease file if it wasn't taken over."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.__read_owner() == self.owner:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _process_shard(
+    rules: RuleBased, manifest: Dict[str, Any], shard: Dict[str, Any], output: str
+) -> None:
+    """Parse the shard and atomically write its result."""
+
+    column = manifest["column"]
+    if manifest["format"] == "parquet":
+        table = pq.ParquetFile(shard["source"]).read_row_group(
+            shard["row_group"], columns=[column]
+        )
+        result = parse_arrow(rules, table, column)
+        _atomic_write(output, lambda path: pq.write_table(result, path))
+    else:
+        data = pd.read_csv(shard["input"])[column].rename("name")
+        result = rules.parse(data)
+        _atomic_write(output, lambda path: result.to_csv(path, index=False))
+
+
+def run_worker(
+    work_dir: str,
+    pathes: Optional[Dict[str, str]] = None,
+    lease_timeout: float = 600.0,
+    poll_interval: float = 5.0,
+    options: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Claim and process shards until all of them are done. Shards of
+    dead workers are retried after their lease expires, processing
+    a shard twice only overwrites its result.
+
+    Parameters
+    ----------
+    work_dir : str
+        Directory with the manifest.
+    pathes : Optional[Dict[str, str]], (default=None)
+        Paths to files for `RuleBased`.
+    lease_timeout : float, (default=600.0)
+        Seconds after which a lease of a silent worker expires.
+    poll_interval : float, (default=5.0)
+        Seconds to wait before checking shards claimed by other workers.
+    options : Optional[Dict[str, Any]], (default=None)
+        Other parameters of `RuleBased`, e.g. `category_cache_size`.
+
+    Returns
+    -------
+    int
+        Number of shards processed by this worker.
+    """
+
+    manifest = load_manifest(work_dir)
+    suffix = f"output.{manifest['format']}"
+    rules: Optional[RuleBased] = None
+    processed = 0
+
+    while True:
+        pending = [
+            shard
+            for shard in manifest["shards"]
+            if not os.path.exists(_shard_path(work_dir, shard, suffix))
+        ]
+        if not pending:
+            return processed
+
+        claimed = False
+        for shard in pending:
+            output = _shard_path(work_dir, shard, suffix)
+            lease = Lease(_shard_path(work_dir, shard, "lease"), lease_timeout)
+            if not lease.acquire():
+                continue
+            try:
+                if not os.path.exists(output):
+                    rules = rules or RuleBased(pathes, **(options or {}))
+                    _process_shard(rules, manifest, shard, output)
+                    processed += 1
+                claimed = True
+            finally:
+                lease.release()
+
+        if not claimed:
+            time.sleep(poll_interval)
+
+
+def merge(work_dir: str, destination: str) -> int:
+    """
+    Merge results of all shards in the order of the manifest.
+
+    Returns
+    -------
+    int
+        Number of rows in the result.
+    """
+
+    manifest = load_manifest(work_dir)
+    suffix = f"output.{manifest['format']}"
+    outputs = [_shard_path(work_dir, shard, suffix) for shard in manifest["shards"]]
+    missing = [path for path in outputs if not os.path.exists(path)]
+    if missing:
+        raise ValueError(f"Не обработано шардов: {len(missing)}.")
+
+    if manifest["format"] == "parquet":
+        writer = None
+        for path in outputs:
+            table = pq.read_table(path)
+            writer = writer or pq.ParquetWriter(destination, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(destination, "w", encoding="UTF-8") as result:
+            for i, path in enumerate(outputs):
+                with open(path, "r", encoding="UTF-8") as shard:
+                    header = shard.readline()
+                    if i == 0:
+                        result.write(header)
+                    for line in shard:
+                        result.write(line)
+    return sum(shard["rows"] for shard in manifest["shards"])
+
+
+# pylint: disable=too-many-arguments
+def run_local(
+    work_dir: str,
+    destination: str,
+    workers: int = 2,
+    pathes: Optional[Dict[str, str]] = None,
+    lease_timeout: float = 600.0,
+    options: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Process all shards with several local worker processes
+    and merge the results. Useful to test the sharded mode
+    on a single machine.
+    """
+
+    processes = [
+        mp.Process(
+            target=run_worker, args=(work_dir, pathes, lease_timeout, 0.5, options),
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return merge(work_dir, destination)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line interface."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = commands.add_parser("plan", help="split input files into shards")
+    plan_parser.add_argument("work_dir")
+    plan_parser.add_argument("sources", nargs="+")
+    plan_parser.add_argument("--column", default="name")
+    plan_parser.add_argument("--shard-size", type=int, default=100000)
+
+    work_parser = commands.add_parser("work", help="process shards")
+    work_parser.add_argument("work_dir")
+    work_parser.add_argument("--lease-timeout", type=float, default=600.0)
+    work_parser.add_argument(
+        "--category-cache-size",
+        type=int,
+        default=65536,
+        help="number of cached predictions of the model, 0 disables the cache",
+    )
+
+    merge_parser = commands.add_parser("merge", help="merge results of shards")
+    merge_parser.add_argument("work_dir")
+    merge_parser.add_argument("destination")
+
+    args = parser.parse_args(argv)
+    if args.command == "plan":
+        manifest = plan(args.work_dir, args.sources, args.column, args.shard_size)
+        print(f"Shards: {len(manifest['shards'])}")
+    elif args.command == "work":
+        options = {"category_cache_size": args.category_cache_size}
+        processed = run_worker(args.work_dir, None, args.lease_timeout, options=options)
+        print(f"Processed shards: {processed}")
+    else:
+        print(f"Rows: {merge(args.work_dir, args.destination)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
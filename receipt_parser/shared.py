@@ -0,0 +1,122 @@
+"""
+Load `RuleBased` once in the parent process and share it
+with forked worker processes without copying.
+"""
+import gc
+import multiprocessing as mp
+from typing import Optional, Dict, List, Union
+import pandas as pd  # type: ignore
+from pymystem3 import Mystem  # type: ignore
+
+try:
+    from receipt_parser.receipt_parser import RuleBased  # type: ignore
+except ImportError:
+    from receipt_parser import RuleBased  # type: ignore
+
+_SHARED: Optional[RuleBased] = None
+_INHERITED: List[Mystem] = []
+
+
+def preload(pathes: Optional[Dict[str, str]] = None, **kwargs) -> RuleBased:
+    """
+    Load lexicons and model weights once before forking workers.
+
+    Model weights are moved to shared memory and all loaded objects
+    are moved to the permanent generation of the garbage collector
+    (`gc.freeze`), so that the collector in forked workers does not
+    touch their memory pages and they stay shared (copy-on-write).
+
+    Parameters
+    ----------
+    pathes: Optional[Dict[str, str]] (default=None)
+        Dictionary with paths to *.csv files.
+    **kwargs
+        Other parameters of `RuleBased`.
+
+    Returns
+    -------
+    RuleBased
+        The shared instance.
+
+    Examples
+    --------
+    >>> preload()
+    >>> parse_parallel(df['name'], processes=32)
+    """
+
+    global _SHARED  # pylint: disable=global-statement
+
+    rules = RuleBased(pathes, **kwargs)
+    rules.find.cat_model.model.share_memory()
+    gc.collect()
+    gc.freeze()
+    _SHARED = rules
+    return rules
+
+
+def get_shared() -> RuleBased:
+    """Return the instance loaded by `preload`."""
+
+    if _SHARED is None:
+        raise RuntimeError("Сначала загрузите данные с помощью `preload`.")
+    return _SHARED
+
+
+def _init_worker() -> None:
+    """
+    Disable nested multiprocessing in a worker process
+    and start its own Mystem process: the parent's one
+    communicates through pipes and can't be shared.
+    """
+
+    rules = get_shared()
+    rules.norm.use_parallel = False
+    # Keep a reference, otherwise the destructor terminates the parent's process:
+    _INHERITED.append(rules.find.mystem)
+    rules.find.mystem = Mystem()
+
+
+def _parse_chunk(chunk: pd.Series) -> pd.DataFrame:
+    """Parse a chunk of descriptions in a worker process."""
+
+    return get_shared().parse(chunk)
+
+
+# pylint: disable=bad-continuation
+def parse_parallel(
+    data: Union[pd.DataFrame, pd.Series],
+    processes: Optional[int] = None,
+    chunk_size: int = 5000,
+) -> pd.DataFrame:
+    """
+    Parse descriptions in forked worker processes
+    which share the instance loaded by `preload`.
+
+    Parameters
+    ----------
+    data : Union[pd.DataFrame, pd.Series]
+        Text column with a description of the products to parse.
+    processes : Optional[int] (default=None)
+        Number of worker processes, `os.cpu_count()` by default.
+    chunk_size : int (default=5000)
+        Number of descriptions sent to a worker at once.
+
+    Returns
+    -------
+    pd.DataFrame
+        Recognized product names, brands and product categories.
+    """
+
+    get_shared()
+    if isinstance(data, pd.DataFrame):
+        if "name" not in data.columns:
+            raise ValueError("Столбец с описанием товара должен иметь название `name`.")
+        data = data["name"]
+
+    chunks: List[pd.Series] = [
+        data.iloc[start : start + chunk_size]
+        for start in range(0, len(data), chunk_size)
+    ]
+    with mp.get_context("fork").Pool(processes, initializer=_init_worker) as pool:
+        results = pool.map(_parse_chunk, chunks)
+    return pd.concat(results) if results else get_shared().parse(data)
@@ -0,0 +1,127 @@
+"""Prefix trie to expand truncated words of product descriptions."""
+from typing import Dict, Iterable, List, Optional
+
+# Returned by `PrefixTrie.complete` if a prefix has several completions:
+AMBIGUOUS = "ambiguous"
+
+
+# pylint: disable=too-few-public-methods
+class _Node:
+    """Node of the trie: children by characters and the number of words below."""
+
+    __slots__ = ("children", "count", "word")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.count = 0
+        self.word: Optional[str] = None
+
+
+class PrefixTrie:
+    """
+    Complete a truncated word to the only word of the vocabulary
+    which starts with it. The lookup walks one node per character
+    of the prefix, each node knows how many words are below it.
+
+    Parameters
+    ----------
+    words : Iterable[str]
+        Vocabulary of complete words.
+    min_prefix : int, (default=3)
+        Shorter prefixes are not completed.
+
+    Examples
+    --------
+    >>> trie = PrefixTrie(['напиток', 'наполнитель', 'молоко'])
+    >>> trie.complete('напит')
+    'напиток'
+    >>> trie.complete('нап')
+    'ambiguous'
+    """
+
+    def __init__(self, words: Iterable[str], min_prefix: int = 3):
+        self.min_prefix = min_prefix
+        self.root = _Node()
+        self.words: List[str] = []
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        node = self.__find(word)
+        return node is not None and node.word == word
+
+    def add(self, word: str) -> None:
+        """Add a word to the vocabulary."""
+
+        if not isinstance(word, str) or not word or word in self:
+            return
+        self.words.append(word)
+        node = self.root
+        node.count += 1
+        for char in word:
+            node = node.children.setdefault(char, _Node())
+            node.count += 1
+        node.word = word
+
+    def __find(self, prefix: str) -> Optional[_Node]:
+        """Return the node of the prefix."""
+
+        node = self.root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                return None
+            node = child
+        return node
+
+    def complete(self, prefix: str) -> Optional[str]:
+        """
+        Return the only word which starts with the prefix,
+        `AMBIGUOUS` if there are several ones or None if there
+        are no such words or the prefix is too short.
+        A complete word of the vocabulary is returned as is.
+        """
+
+        if len(prefix) < self.min_prefix:
+            return None
+        node = self.__find(prefix)
+        if node is None:
+            return None
+        if node.word is not None:
+            return node.word
+        if node.count > 1:
+            return AMBIGUOUS
+        while node.word is None:
+            node = next(iter(node.children.values()))
+        return node.word
+
+    def expand(self, word: str, mapping: Optional[Dict[str, str]] = None) -> str:
+        """
+        Replace the word with its explicit mapping or with its only
+        completion. Ambiguous and unknown words are kept as is.
+        """
+
+        if mapping and word in mapping:
+            return mapping[word]
+        completion = self.complete(word)
+        if completion is None or completion == AMBIGUOUS:
+            return word
+        return completion
+
+
+def build_vocabulary(
+    products: Iterable[str], mapping: Optional[Dict[str, str]] = None
+) -> List[str]:
+    """
+    Collect canonical product names consisting of one word:
+    values of `dicts.PRODUCTS` and products of `products.csv`.
+    """
+
+    words: Dict[str, None] = {}
+    for name in list((mapping or {}).values()) + list(products):
+        if isinstance(name, str) and name.isalpha():
+            words[name] = None
+    return list(words)
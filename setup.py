@@ -40,6 +40,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/slgero/receipt_parser",
     packages=setuptools.find_packages(include=["receipt_parser", "receipt_parser.*"]),
+    package_data={"receipt_parser": ["data/*.csv", "data/cleaned/*.csv", "models/*.*"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -49,6 +50,7 @@ setuptools.setup(
         "Natural Language :: Russian",
     ],
     install_requires=INSTALL_REQUIRES,
+    extras_require={"arrow": ["pyarrow >= 1.0.0"]},
     python_requires=">=3.6",
     keywords=["receipt parser", "product parser", "nlp"],
 )